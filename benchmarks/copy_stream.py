@@ -0,0 +1,76 @@
+"""Times the copy loop downloads used before copy_stream against copy_stream itself"""
+# The source only overrides read, like librespot's AbsChunkedInputStream, and hands out at
+# most one CDN chunk per call. Run it with: python benchmarks/copy_stream.py [MiB]
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'zspotify'))
+
+# The modules are not a package, they import each other from the zspotify folder
+# pylint: disable=C0413, E0401
+from const import CHUNK_SIZE, CONFIG_DEFAULT_SETTINGS
+from track import copy_stream
+
+# librespot downloads audio in chunks of 128 KiB
+CDN_CHUNK_SIZE = 128 * 1024
+
+ROUNDS = 3
+
+
+class ChunkedStream(io.BytesIO):
+    """Read-only stream over data that returns at most one CDN chunk per read"""
+
+    def __init__(self, data: bytes):
+        super().__init__()
+        self.data = memoryview(data)
+        self.position = 0
+
+    def read(self, size=-1) -> bytes:
+        chunk_end = (self.position // CDN_CHUNK_SIZE + 1) * CDN_CHUNK_SIZE
+        end = chunk_end if size is None or size < 0 else min(self.position + size, chunk_end)
+        chunk = bytes(self.data[self.position:end])
+        self.position += len(chunk)
+        return chunk
+
+
+def copy_fixed_chunks(source, file, total_size) -> int:
+    """The loop downloads used before copy_stream: fixed CHUNK_SIZE reads until total_size"""
+    copied = 0
+    while copied < total_size:
+        copied += file.write(source.read(CONFIG_DEFAULT_SETTINGS[CHUNK_SIZE]))
+    return copied
+
+
+def copy_adaptive(source, file, total_size) -> int:
+    """copy_stream without its progress bar"""
+    return copy_stream(source, file, total_size, 'benchmark', disable_progressbar=True)
+
+
+def run(copy, data) -> float:
+    """Returns the best time of ROUNDS copies of data into a temporary file"""
+    best = float('inf')
+    for _ in range(ROUNDS):
+        with tempfile.TemporaryFile() as file:
+            started = time.perf_counter()
+            copied = copy(ChunkedStream(data), file, len(data))
+            elapsed = time.perf_counter() - started
+        if copied != len(data):
+            raise RuntimeError(f'{copy.__name__} copied {copied} of {len(data)} bytes')
+        best = min(best, elapsed)
+    return best
+
+
+def main():
+    """Prints the time and throughput of both loops"""
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 256
+    data = os.urandom(size * 1024 * 1024)
+    for copy in (copy_fixed_chunks, copy_adaptive):
+        elapsed = run(copy, data)
+        print(f'{copy.__name__:<20} {elapsed:7.3f} s {size / elapsed:9.1f} MiB/s')
+
+
+if __name__ == '__main__':
+    main()
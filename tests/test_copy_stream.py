@@ -0,0 +1,68 @@
+"""Checks that copy_stream copies every byte of the sources downloads read from"""
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'zspotify'))
+
+# The modules are not a package, they import each other from the zspotify folder
+# pylint: disable=C0413, E0401
+from track import copy_stream, get_readinto
+
+SIZE = 1000000
+
+
+class ReadOnlyStream(io.BytesIO):
+    """Serves data like librespot's AbsChunkedInputStream, overriding only read"""
+
+    def __init__(self, data: bytes):
+        super().__init__()
+        self.data = data
+        self.position = 0
+
+    def read(self, size=-1) -> bytes:
+        end = len(self.data) if size is None or size < 0 else self.position + size
+        chunk = self.data[self.position:end]
+        self.position += len(chunk)
+        return chunk
+
+    def seek(self, offset, whence=0) -> int:  # pylint: disable=W0613
+        self.position = offset
+        return offset
+
+
+class CopyStreamTest(unittest.TestCase):
+    """Copies a megabyte from each kind of source"""
+
+    def setUp(self):
+        self.data = os.urandom(SIZE)
+
+    def test_read_only_stream(self):
+        """The readinto inherited from BytesIO is not used"""
+        source = ReadOnlyStream(self.data)
+        self.assertIsNone(get_readinto(source))
+        target = io.BytesIO()
+        self.assertEqual(copy_stream(source, target, SIZE, 'test', True), SIZE)
+        self.assertEqual(target.getvalue(), self.data)
+
+    def test_readinto_stream(self):
+        """A source with a matching readinto is read through the buffer"""
+        source = io.BytesIO(self.data)
+        self.assertIsNotNone(get_readinto(source))
+        target = io.BytesIO()
+        self.assertEqual(copy_stream(source, target, SIZE, 'test', True), SIZE)
+        self.assertEqual(target.getvalue(), self.data)
+
+    def test_resume_from_offset(self):
+        """A resumed download copies only the bytes after offset"""
+        offset = SIZE // 3
+        source = ReadOnlyStream(self.data)
+        source.seek(offset)
+        target = io.BytesIO()
+        self.assertEqual(copy_stream(source, target, SIZE, 'test', True, offset), SIZE - offset)
+        self.assertEqual(target.getvalue(), self.data[offset:])
+
+
+if __name__ == '__main__':
+    unittest.main()
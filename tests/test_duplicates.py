@@ -0,0 +1,95 @@
+"""Checks which release of a recording shared by several track ids is downloaded"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'zspotify'))
+
+# The modules are not a package, they import each other from the zspotify folder
+# pylint: disable=C0413, E0401
+from const import DUPLICATE_POLICY, DOWNLOAD_FORMAT, LIBRARY_INDEX_PATH
+from library import LibraryIndex
+from track import find_duplicate_recordings
+from utils import DuplicatePolicy
+from zspotify import ZSpotify
+
+ISRC = 'USUM71703861'
+
+
+def song_info(track_id, album_type, release_date, isrc=ISRC, is_playable=True):
+    """Returns the get_songs_info tuple of a track on a release of album_type"""
+    return (['Artist'], 'Album', 'Song', None, release_date[:4], 1, 1, track_id, is_playable,
+            (isrc, album_type, release_date))
+
+
+SONGS_INFO = {
+    'single': song_info('single', 'single', '2017-01-01'),
+    'album': song_info('album', 'album', '2018-01-01'),
+    'compilation': song_info('compilation', 'compilation', '2016-01-01'),
+}
+
+
+class DuplicateRecordingsTest(unittest.TestCase):
+    """Runs find_duplicate_recordings under each DUPLICATE_POLICY"""
+
+    def setUp(self):
+        ZSpotify.LIBRARY_INDEX = None
+        ZSpotify.CONFIG = {DUPLICATE_POLICY: DuplicatePolicy.PREFER_ALBUM.value,
+                           DOWNLOAD_FORMAT: 'mp3', LIBRARY_INDEX_PATH: ''}
+
+    def tearDown(self):
+        ZSpotify.LIBRARY_INDEX = None
+        ZSpotify.CONFIG = {}
+
+    def test_keep_all(self):
+        """keep_all downloads every track id"""
+        ZSpotify.CONFIG[DUPLICATE_POLICY] = DuplicatePolicy.KEEP_ALL.value
+        self.assertEqual(find_duplicate_recordings(SONGS_INFO, {}), {})
+
+    def test_prefer_album(self):
+        """prefer_album keeps the album release"""
+        chosen = {}
+        self.assertEqual(find_duplicate_recordings(SONGS_INFO, chosen),
+                         {'single': None, 'compilation': None})
+        self.assertEqual(chosen, {ISRC: 'album'})
+
+    def test_prefer_earliest(self):
+        """prefer_earliest keeps the earliest release"""
+        ZSpotify.CONFIG[DUPLICATE_POLICY] = DuplicatePolicy.PREFER_EARLIEST.value
+        self.assertEqual(find_duplicate_recordings(SONGS_INFO, {}),
+                         {'single': None, 'album': None})
+
+    def test_choice_carries_over_between_calls(self):
+        """A recording kept by an earlier batch stays kept over a better later release"""
+        chosen = {}
+        find_duplicate_recordings({'single': SONGS_INFO['single']}, chosen)
+        self.assertEqual(find_duplicate_recordings({'album': SONGS_INFO['album']}, chosen),
+                         {'album': None})
+
+    def test_ignored_tracks(self):
+        """Tracks without an ISRC or that cannot be played are never duplicates"""
+        songs_info = {'album': SONGS_INFO['album'],
+                      'no_isrc': song_info('no_isrc', 'single', '2017-01-01', isrc=None),
+                      'unplayable': song_info('unplayable', 'single', '2017-01-01',
+                                              is_playable=False)}
+        self.assertEqual(find_duplicate_recordings(songs_info, {}), {})
+
+    def test_library_copy_is_linked(self):
+        """A recording already in the library maps every track id to that file"""
+        with tempfile.TemporaryDirectory() as directory:
+            index = ZSpotify.LIBRARY_INDEX = LibraryIndex(os.path.join(directory, 'index.db'))
+            path = os.path.join(directory, 'single.mp3')
+            with open(path, 'wb') as file:
+                file.write(b'audio')
+            index.record('single', path, 'mp3')
+            index.record_recordings({'single': ISRC})
+            try:
+                self.assertEqual(find_duplicate_recordings(SONGS_INFO, {}),
+                                 {'album': path, 'compilation': path})
+            finally:
+                index.connection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
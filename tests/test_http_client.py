@@ -0,0 +1,87 @@
+"""Checks that Web API calls reuse the keep-alive connections of the shared http client"""
+import os
+import sys
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'zspotify'))
+
+# The modules are not a package, they import each other from the zspotify folder
+# pylint: disable=C0413, E0401
+from const import HTTP_POOL_SIZE
+from zspotify import ZSpotify
+
+POOL_SIZE = 4
+
+
+class CountingServer(ThreadingHTTPServer):
+    """Answers every request with a small JSON body and counts the connections it accepts"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), CountingHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+
+    def url(self, path='/') -> str:
+        """Returns the address of path on this server"""
+        return f'http://127.0.0.1:{self.server_address[1]}{path}'
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    """Keeps connections open between requests like the Web API does"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):  # pylint: disable=C0103
+        """Answers {}"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        """Keeps the test output clean"""
+
+
+class HttpClientTest(unittest.TestCase):
+    """Counts the sockets the shared http client opens"""
+
+    def setUp(self):
+        ZSpotify.CONFIG = {HTTP_POOL_SIZE: POOL_SIZE}
+        ZSpotify.HTTP_CLIENT = None
+        self.server = CountingServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        ZSpotify.get_http_client().close()
+        ZSpotify.HTTP_CLIENT = None
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_sequential_calls_share_one_connection(self):
+        """Calls made one after the other go over the same socket"""
+        for _ in range(20):
+            self.assertEqual(ZSpotify.http_get(self.server.url()).json(), {})
+        self.assertEqual(self.server.connections, 1)
+
+    def test_concurrent_calls_stay_within_the_pool(self):
+        """Threads beyond HTTP_POOL_SIZE wait for a pooled connection"""
+        with ThreadPoolExecutor(max_workers=POOL_SIZE * 4) as executor:
+            responses = list(executor.map(lambda _: ZSpotify.http_get(self.server.url()),
+                                          range(200)))
+        self.assertTrue(all(response.status_code == 200 for response in responses))
+        self.assertLessEqual(self.server.connections, POOL_SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+"""Checks the claim, lease, finish, requeue and cancel states of the batch job queue"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'zspotify'))
+
+# The modules are not a package, they import each other from the zspotify folder
+# pylint: disable=C0413, E0401
+from jobqueue import JobQueue, JobKind, JobState
+
+ALBUM_URL = 'https://open.spotify.com/album/4aawyAB9vmqN3uQ7FjRGTy'
+
+PLAYLIST_URL = 'https://open.spotify.com/playlist/37i9dQZF1DXcBWIGoYBM5M'
+
+MAX_ATTEMPTS = 3
+
+
+class JobQueueTest(unittest.TestCase):
+    """Runs every case against a fresh queue file"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=R1732
+        self.path = os.path.join(self.directory.name, 'jobs.db')
+        self.queue = JobQueue(self.path)
+
+    def tearDown(self):
+        self.queue.connection.close()
+        self.directory.cleanup()
+
+    def expand(self, url, *track_ids):
+        """Adds url and queues a track job for each of track_ids under it"""
+        source_id = self.queue.submit(url)
+        self.queue.source = url
+        for track_id in track_ids:
+            self.queue.add_job(JobKind.TRACK, track_id, 'Album', info={'id': track_id})
+        self.queue.source = None
+        self.queue.set_source_state(url, JobState.DONE)
+        return source_id
+
+    def test_claim_hands_out_jobs_in_order_with_their_info(self):
+        """Jobs come out oldest first, each once, with the metadata stored when queued"""
+        self.expand(ALBUM_URL, 'track1', 'track2')
+        first, second = self.queue.claim(), self.queue.claim()
+        self.assertEqual((first[2], first[5]), ('track1', {'id': 'track1'}))
+        self.assertEqual(second[2], 'track2')
+        self.assertIsNone(self.queue.claim())
+        self.assertFalse(self.queue.is_drained())
+
+    def test_resume_after_crash(self):
+        """A job left running by a crashed run is claimed again by the next one"""
+        self.expand(ALBUM_URL, 'track1', 'track2')
+        crashed = self.queue.claim()
+        self.queue.connection.close()
+
+        self.queue = JobQueue(self.path)
+        self.assertEqual(self.queue.requeue_running(), 1)
+        claimed = {self.queue.claim()[0], self.queue.claim()[0]}
+        self.assertIn(crashed[0], claimed)
+        for job_id in claimed:
+            self.assertEqual(self.queue.finish(job_id), JobState.DONE)
+        self.assertTrue(self.queue.is_drained())
+
+    def test_retries_up_to_max_attempts(self):
+        """A failing job goes back to pending until it used MAX_ATTEMPTS, then fails"""
+        self.expand(ALBUM_URL, 'track1')
+        states = []
+        for _ in range(MAX_ATTEMPTS):
+            job = self.queue.claim()
+            states.append(self.queue.finish(job[0], 'error', MAX_ATTEMPTS))
+        self.assertEqual(states, [JobState.PENDING] * (MAX_ATTEMPTS - 1) + [JobState.FAILED])
+        self.assertIsNone(self.queue.claim())
+        self.assertEqual(self.queue.counts(), {JobState.FAILED.value: 1})
+
+    def test_resubmit_retries_failed_jobs(self):
+        """Submitting a url again gives its failed jobs fresh attempts"""
+        self.expand(ALBUM_URL, 'track1')
+        job = self.queue.claim()
+        self.queue.finish(job[0], 'error')
+        self.expand(ALBUM_URL)
+        self.assertEqual(self.queue.claim()[0], job[0])
+
+    def test_expired_lease_goes_to_another_worker(self):
+        """A job whose lease ran out is claimed by another worker and lost by the first"""
+        self.expand(ALBUM_URL, 'track1')
+        # A negative lease has run out before the next claim
+        job = self.queue.claim('worker1', -1)
+        self.assertEqual(self.queue.claim('worker2', 300)[0], job[0])
+        self.assertFalse(self.queue.renew(job[0], 'worker1', 300))
+        self.assertIsNone(self.queue.finish(job[0], owner='worker1'))
+        self.assertTrue(self.queue.renew(job[0], 'worker2', 300))
+        self.assertEqual(self.queue.finish(job[0], owner='worker2'), JobState.DONE)
+
+    def test_leased_job_is_not_requeued(self):
+        """requeue_running leaves a job to its lease"""
+        self.expand(ALBUM_URL, 'track1')
+        self.queue.claim('worker1', 300)
+        self.assertEqual(self.queue.requeue_running(), 0)
+        self.assertIsNone(self.queue.claim('worker2', 300))
+
+    def test_cancel_keeps_jobs_another_source_wants(self):
+        """A job is only cancelled with the last source that wants it"""
+        album_id = self.expand(ALBUM_URL, 'shared', 'album_only')
+        playlist_id = self.expand(PLAYLIST_URL, 'shared')
+        self.assertEqual(self.queue.get_source(playlist_id)['jobs'], {JobState.PENDING.value: 1})
+
+        self.assertTrue(self.queue.cancel_source(album_id))
+        self.assertEqual(self.queue.get_source(album_id)['jobs'],
+                         {JobState.PENDING.value: 1, JobState.CANCELLED.value: 1})
+
+        self.assertTrue(self.queue.cancel_source(playlist_id))
+        self.assertEqual(self.queue.get_source(playlist_id)['jobs'],
+                         {JobState.CANCELLED.value: 1})
+        self.assertIsNone(self.queue.claim())
+
+        self.expand(ALBUM_URL)
+        self.assertEqual({self.queue.claim()[2], self.queue.claim()[2]}, {'shared', 'album_only'})
+        self.assertFalse(self.queue.cancel_source(album_id + playlist_id))
+
+    def test_cancelled_source_queues_nothing(self):
+        """Jobs added while expanding a cancelled source are dropped"""
+        source_id = self.queue.submit(ALBUM_URL)
+        self.queue.cancel_source(source_id)
+        self.queue.source = ALBUM_URL
+        self.queue.add_job(JobKind.TRACK, 'track1')
+        self.assertIsNone(self.queue.claim())
+        self.assertTrue(self.queue.is_drained())
+
+    def test_empty_until_a_url_is_added(self):
+        """A queue nobody added a url to is empty, which workers tell apart from drained"""
+        self.assertTrue(self.queue.is_empty())
+        self.queue.add_sources([ALBUM_URL])
+        self.assertFalse(self.queue.is_empty())
+        self.assertFalse(self.queue.is_drained())
+
+
+if __name__ == '__main__':
+    unittest.main()
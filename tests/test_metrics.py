@@ -0,0 +1,44 @@
+"""Checks the metrics registry exports what invoke_api and the download stages record"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'zspotify'))
+
+# The modules are not a package, they import each other from the zspotify folder
+# pylint: disable=C0413, E0401
+from metrics import Metrics, get_endpoint
+
+
+class MetricsTest(unittest.TestCase):
+    """Exports a registry filled like a run with the response cache on"""
+
+    def setUp(self):
+        self.metrics = Metrics()
+        endpoint = get_endpoint('/v1/albums/4aawyAB9vmqN3uQ7FjRGTy/tracks')
+        self.metrics.increment('api_calls', endpoint=endpoint, status=200)
+        self.metrics.increment('api_calls', endpoint=endpoint, status='cache')
+        self.metrics.increment('api_calls', endpoint=endpoint, status=200)
+        self.metrics.observe('api', 0.2)
+        self.metrics.observe('api', 0.02)
+
+    def test_prometheus_mixes_status_codes_and_cache_hits(self):
+        """Numeric and text label values of one counter export side by side"""
+        text = self.metrics.to_prometheus()
+        counter = 'zspotify_api_calls_total{endpoint="/v1/albums/{id}/tracks"'
+        self.assertIn(f'{counter},status="200"}} 2', text)
+        self.assertIn(f'{counter},status="cache"}} 1', text)
+        self.assertIn('zspotify_stage_seconds_count{stage="api"} 2', text)
+
+    def test_summary(self):
+        """The summary reports every counter and quantiles capped at the slowest call"""
+        summary = self.metrics.summary()
+        self.assertEqual(summary['counters']['api_calls'],
+                         {'endpoint=/v1/albums/{id}/tracks,status=200': 2,
+                          'endpoint=/v1/albums/{id}/tracks,status=cache': 1})
+        self.assertEqual(summary['stages']['api']['count'], 2)
+        self.assertLessEqual(summary['stages']['api']['p95_seconds'], 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
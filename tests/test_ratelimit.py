@@ -0,0 +1,67 @@
+"""Checks how the adaptive rate limiter paces calls, backs off and recovers"""
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'zspotify'))
+
+# The modules are not a package, they import each other from the zspotify folder
+# pylint: disable=C0413, E0401
+from ratelimit import RateLimiter, parse_retry_after, BACKOFF_BASE, BACKOFF_MAX
+
+RATE = 50
+
+
+class RateLimiterTest(unittest.TestCase):
+    """Runs a limiter of RATE calls per second"""
+
+    def test_burst_then_paced(self):
+        """The burst goes through at once, the next call waits for a token"""
+        limiter = RateLimiter(RATE, burst=5)
+        self.assertEqual([limiter.acquire() for _ in range(5)], [0.0] * 5)
+        started = time.monotonic()
+        waited = limiter.acquire()
+        self.assertGreater(waited, 0)
+        self.assertGreaterEqual(time.monotonic() - started, 0.5 / RATE)
+        self.assertEqual(limiter.stats['calls'], 6)
+        self.assertEqual(limiter.stats['throttled_calls'], 1)
+
+    def test_retry_after_blocks_every_caller(self):
+        """A Retry-After holds the next call back for that long even with tokens left"""
+        limiter = RateLimiter(RATE, burst=5)
+        self.assertEqual(limiter.throttled(0.1), 0.1)
+        started = time.monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    def test_backoff_without_retry_after(self):
+        """Without Retry-After the wait doubles on every failure up to BACKOFF_MAX"""
+        limiter = RateLimiter(RATE)
+        waits = [limiter.throttled() for _ in range(10)]
+        self.assertEqual(waits[:3], [BACKOFF_BASE, BACKOFF_BASE * 2, BACKOFF_BASE * 4])
+        self.assertEqual(waits[-1], BACKOFF_MAX)
+
+    def test_rate_halves_and_recovers(self):
+        """Throttling halves the rate down to a sixteenth, successes bring it back"""
+        limiter = RateLimiter(RATE)
+        limiter.throttled(0)
+        self.assertEqual(limiter.rate, RATE / 2)
+        for _ in range(10):
+            limiter.throttled(0)
+        self.assertEqual(limiter.rate, RATE / 16)
+        for _ in range(100):
+            limiter.succeeded()
+        self.assertEqual(limiter.rate, RATE)
+        self.assertEqual(limiter.failures, 0)
+
+    def test_parse_retry_after(self):
+        """Seconds are read as a float, anything else is ignored"""
+        self.assertEqual(parse_retry_after('3'), 3.0)
+        self.assertEqual(parse_retry_after('-1'), 0.0)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""Checks that a playlist sync downloads only what changed since the stored snapshot"""
+import io
+import os
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'zspotify'))
+
+# The modules are not a package, they import each other from the zspotify folder
+# pylint: disable=C0413, E0401
+import playlist
+from const import ROOT_PATH, SYNC_REMOVE_DELETED
+from library import LibraryIndex
+from utils import DownloadStatus
+from zspotify import ZSpotify
+
+PLAYLIST_ID = '37i9dQZF1DXcBWIGoYBM5M'
+
+PLAYLIST_NAME = 'Mix'
+
+
+class SyncPlaylistTest(unittest.TestCase):
+    """Syncs a playlist whose snapshot and tracks each case sets"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=R1732
+        self.index = LibraryIndex(os.path.join(self.directory.name, 'index.db'))
+        ZSpotify.LIBRARY_INDEX = self.index
+        ZSpotify.CONFIG = {ROOT_PATH: self.directory.name, SYNC_REMOVE_DELETED: True}
+        self.snapshot = 'snapshot1'
+        self.track_ids = []
+        self.downloaded = []
+        self.failing = set()
+        self.patches = [
+            mock.patch.object(playlist, 'get_playlist_snapshot',
+                              lambda _: (PLAYLIST_NAME, self.snapshot)),
+            mock.patch.object(playlist, 'get_playlist_track_ids', lambda _: self.track_ids),
+            mock.patch.object(playlist, 'download_tracks', self.download_tracks)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        ZSpotify.LIBRARY_INDEX = None
+        ZSpotify.CONFIG = {}
+        self.index.connection.close()
+        self.directory.cleanup()
+
+    def download_tracks(self, track_ids, extra_paths, desc=None):  # pylint: disable=W0613
+        """Stands in for the download, writing and indexing a file per track"""
+        results = []
+        for track_id in track_ids:
+            self.downloaded.append(track_id)
+            if track_id in self.failing:
+                results.append((track_id, DownloadStatus.FAILED))
+                continue
+            path = os.path.join(self.directory.name, extra_paths, f'{track_id}.mp3')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(b'audio')
+            self.index.record(track_id, path, 'mp3')
+            results.append((track_id, DownloadStatus.DOWNLOADED))
+        return results
+
+    def sync(self, snapshot, track_ids):
+        """Syncs the playlist at snapshot and returns the tracks it downloaded"""
+        self.snapshot, self.track_ids, self.downloaded = snapshot, track_ids, []
+        with redirect_stdout(io.StringIO()):
+            playlist.sync_playlist(PLAYLIST_ID)
+        return self.downloaded
+
+    def test_first_sync_downloads_everything(self):
+        """Without a stored snapshot every track is new, repeats only once"""
+        self.assertEqual(self.sync('snapshot1', ['a', 'b', 'a']), ['a', 'b'])
+        self.assertEqual(self.index.get_playlist(PLAYLIST_ID), ('snapshot1', ['a', 'b']))
+
+    def test_unchanged_snapshot_downloads_nothing(self):
+        """The same snapshot id skips listing the playlist"""
+        self.sync('snapshot1', ['a', 'b'])
+        self.assertEqual(self.sync('snapshot1', ['a', 'b', 'c']), [])
+
+    def test_changed_snapshot_downloads_added_and_removes_deleted(self):
+        """Only the added tracks are downloaded, a removed one is deleted from the folder"""
+        self.sync('snapshot1', ['a', 'b'])
+        removed_path = self.index.lookup('b')[0]
+        self.assertEqual(self.sync('snapshot2', ['a', 'c']), ['c'])
+        self.assertFalse(os.path.exists(removed_path))
+        self.assertIsNone(self.index.lookup('b'))
+        self.assertEqual(self.index.get_playlist(PLAYLIST_ID), ('snapshot2', ['a', 'c']))
+
+    def test_failed_tracks_are_retried(self):
+        """A failed download is retried by the next sync of the same snapshot"""
+        self.failing = {'b'}
+        self.assertEqual(self.sync('snapshot1', ['a', 'b']), ['a', 'b'])
+        self.assertEqual(self.index.get_playlist(PLAYLIST_ID), (None, ['a']))
+        self.failing = set()
+        self.assertEqual(self.sync('snapshot1', ['a', 'b']), ['b'])
+        self.assertEqual(self.index.get_playlist(PLAYLIST_ID), ('snapshot1', ['a', 'b']))
+
+
+if __name__ == '__main__':
+    unittest.main()
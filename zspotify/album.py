@@ -1,30 +1,20 @@
 """This modules provides helper functions for getting album info, and downloading the albums"""
-from tqdm import tqdm
-
-from const import ITEMS, ARTISTS, NAME, ID
-from track import download_track
-from utils import sanitize_data
+from const import ARTISTS, NAME, ID, ALBUMS, TRACKS, ITEMS, NEXT, INCLUDE_GROUPS, \
+    ARTIST_ALBUM_GROUPS, DUPLICATE_POLICY
+from engine import download_tracks
+from track import parse_song_info, get_songs_info, find_duplicate_recordings
+from utils import sanitize_data, chunked, DuplicatePolicy
 from zspotify import ZSpotify
 
 ALBUM_URL = 'https://api.spotify.com/v1/albums'
 ARTIST_URL = 'https://api.spotify.com/v1/artists'
+ALBUMS_BATCH_SIZE = 20
 
 
-def get_album_tracks(album_id):
-    """ Returns album tracklist """
-    album_songs = []
-    offset = 0
-    limit = 50
-
-    while True:
-        resp = ZSpotify.invoke_url_with_params(f'{ALBUM_URL}/{album_id}/tracks',
-                                               limit=limit, offset=offset)
-        offset += limit
-        album_songs.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
-
-    return album_songs
+def iter_album_track_ids(album_id):
+    """ Yields the ids of an album's tracks as each page arrives """
+    for track in ZSpotify.iter_url_paginated(f'{ALBUM_URL}/{album_id}/tracks', limit=50):
+        yield track[ID]
 
 
 def get_album_name(album_id):
@@ -33,32 +23,57 @@ def get_album_name(album_id):
     return resp[ARTISTS][0][NAME], sanitize_data(resp[NAME])
 
 
-def get_artist_albums(artist_id):
-    """ Returns artist's albums """
-    resp = ZSpotify.invoke_url(f'{ARTIST_URL}/{artist_id}/albums')
-    # Return a list each album's id
-    album_ids = [resp[ITEMS][i][ID] for i in range(len(resp[ITEMS]))]
-    # Recursive requests to get all albums including singles an EPs
-    while resp['next']:
-        resp = ZSpotify.invoke_url(resp['next'])
-        album_ids.extend([resp[ITEMS][i][ID] for i in range(len(resp[ITEMS]))])
+def get_artist_albums(artist_id, include_groups=None):
+    """ Returns artist's albums, limited to the comma separated album groups when given """
+    # Return a list each album's id, including singles and EPs
+    params = {INCLUDE_GROUPS: include_groups} if include_groups else {}
+    return [album[ID] for album in
+            ZSpotify.invoke_url_paginated(f'{ARTIST_URL}/{artist_id}/albums', limit=50,
+                                          **params)]
+
 
-    return album_ids
+def get_albums(album_ids):
+    """ Yields full album objects, ALBUMS_BATCH_SIZE per request, with all their tracks """
+    for batch in chunked(album_ids, ALBUMS_BATCH_SIZE):
+        resp = ZSpotify.invoke_url(f'{ALBUM_URL}?ids={",".join(batch)}&market=from_token')
+        for album in resp[ALBUMS]:
+            if not album:
+                continue
+            # Only the first page of tracks is embedded in the album object
+            page = album[TRACKS]
+            while page[NEXT]:
+                page = ZSpotify.invoke_url(page[NEXT])
+                album[TRACKS][ITEMS].extend(page[ITEMS])
+            yield album
 
 
 def download_album(album):
     """ Downloads songs from an album """
     artist, album_name = get_album_name(album)
-    tracks = get_album_tracks(album)
-    p_bar = tqdm(enumerate(tracks, start=1), unit_scale=True, unit='Song', total=len(tracks))
-    for album_number, track in p_bar:
-        download_track(track[ID], f'{artist}/{album_name}',
-                       prefix=True, prefix_value=str(album_number), disable_progressbar=True)
-        p_bar.set_description(album_name)
+    download_tracks(iter_album_track_ids(album), f'{artist}/{album_name}',
+                    prefix=True, desc=album_name)
 
 
 def download_artist_albums(artist):
-    """ Downloads albums of an artist """
-    albums = get_artist_albums(artist)
-    for album_id in albums:
-        download_album(album_id)
+    """ Downloads the albums of an artist in the groups set by ARTIST_ALBUM_GROUPS """
+    # A track found on several releases is only downloaded with the first one. Unless
+    # DUPLICATE_POLICY keeps all of them, one release of every recording is picked across the
+    # whole discography, which needs the full track objects since only those carry the ISRC.
+    album_ids = get_artist_albums(artist, ZSpotify.get_config(ARTIST_ALBUM_GROUPS))
+    albums = get_albums(album_ids)
+    duplicates = None
+    if ZSpotify.get_config(DUPLICATE_POLICY) != DuplicatePolicy.KEEP_ALL:
+        albums = list(albums)
+        duplicates = find_duplicate_recordings(
+            get_songs_info(track[ID] for album in albums for track in album[TRACKS][ITEMS]), {})
+    downloaded = set()
+    for album in albums:
+        artist_name = album[ARTISTS][0][NAME]
+        album_name = sanitize_data(album[NAME])
+        tracks = album[TRACKS][ITEMS]
+        songs_info = {track[ID]: parse_song_info(track, album) for track in tracks}
+        track_ids = [track[ID] for track in tracks]
+        download_tracks(track_ids, f'{artist_name}/{album_name}', prefix=True, desc=album_name,
+                        songs_info=songs_info, total=len(track_ids), skip=downloaded,
+                        duplicates=duplicates)
+        downloaded.update(track_ids)
@@ -1,5 +1,12 @@
 """This module provides functions for searching and processing user inputs"""
+import json
+import multiprocessing
+import os
+import socket
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 from librespot.audio.decoders import AudioQuality
@@ -7,19 +14,69 @@ from tabulate import tabulate
 
 from album import download_album, download_artist_albums
 from const import TRACK, NAME, ID, ARTIST, ARTISTS, ITEMS, TRACKS, EXPLICIT, ALBUM, ALBUMS, \
-    OWNER, PLAYLIST, PLAYLISTS, DISPLAY_NAME, TYPE
-from playlist import get_playlist_songs, get_playlist_info, download_playlist, \
-    download_from_user_playlist
-from podcast import download_episode, get_show_episodes
-from track import download_track, get_saved_tracks
-from utils import sanitize_data, splash, split_input, regex_input_for_urls
+    OWNER, PLAYLIST, PLAYLISTS, DISPLAY_NAME, TYPE, ROOT_PATH, JOB_QUEUE_PATH, MAX_JOB_ATTEMPTS, \
+    MAX_CONCURRENT_DOWNLOADS, DAEMON_HOST, DAEMON_PORT, JOB_LEASE_SECONDS, METRICS_SUMMARY_PATH
+from daemon import DownloadDaemon
+from playlist import get_playlist_info, download_playlist, download_from_user_playlist, \
+    get_all_playlists, sync_playlist, iter_playlist_track_ids
+from podcast import download_episode, download_show
+from engine import download_tracks
+from jobqueue import JobQueue, JobState, JobKind
+from track import download_track, iter_saved_track_ids
+from utils import sanitize_data, splash, split_input, regex_input_for_urls, DownloadStatus
 from zspotify import ZSpotify
 
 SEARCH_URL = 'https://api.spotify.com/v1/search'
 
+JOB_FAILURES = (DownloadStatus.FAILED, DownloadStatus.METADATA_ERROR)
+
+WORKER_POLL_SECONDS = 5
+
+COORDINATOR_REPORT_SECONDS = 30
+
 
 def client() -> None:
     """ Connects to spotify to perform query's and get songs to download """
+    if '--no-cache' in sys.argv:
+        sys.argv.remove('--no-cache')
+        ZSpotify.RESPONSE_CACHE_BYPASS = True
+
+    if len(sys.argv) > 1 and sys.argv[1] == '--rebuild-index':
+        rebuild_library_index()
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        # Every worker process logs in on its own
+        run_workers(int(sys.argv[2]) if len(sys.argv) > 2 else 1)
+        return
+
+    login()
+
+    try:
+        if len(sys.argv) > 1:
+            process_sysargs_input()
+        else:
+            search_text = ''
+            while len(search_text) == 0:
+                search_text = input('Enter search or URL: ')
+
+            process_url_input(search_text, call_search=True)
+    finally:
+        write_metrics_summary()
+
+
+def write_metrics_summary(suffix='') -> None:
+    """Writes the stage timings and counters of this run as JSON to METRICS_SUMMARY_PATH"""
+    path = ZSpotify.get_config(METRICS_SUMMARY_PATH)
+    if not path:
+        return
+    with open(os.path.join(os.path.dirname(__file__), path) + suffix, 'w',
+              encoding='utf-8') as file:
+        json.dump(ZSpotify.METRICS.summary(), file, indent=2)
+
+
+def login() -> None:
+    """ Logs in and picks the download quality the account allows """
     ZSpotify()
     splash()
 
@@ -30,32 +87,210 @@ def client() -> None:
         print('[ DETECTED FREE ACCOUNT - USING HIGH QUALITY ]\n\n')
         ZSpotify.DOWNLOAD_QUALITY = AudioQuality.HIGH
 
-    if len(sys.argv) > 1:
-        process_sysargs_input()
-    else:
-        search_text = ''
-        while len(search_text) == 0:
-            search_text = input('Enter search or URL: ')
-
-        process_url_input(search_text, call_search=True)
 
-
-def process_sysargs_input():
+def rebuild_library_index():
+    """Scans the music folder, or the folder given after the option, into the library index"""
+    ZSpotify.load_config()
+    index = ZSpotify.get_library_index()
+    if index is None:
+        print('###   LIBRARY INDEX IS DISABLED - SET LIBRARY_INDEX_PATH TO USE IT   ###')
+        return
+    root = sys.argv[2] if len(sys.argv) > 2 else \
+        os.path.join(os.path.dirname(__file__), ZSpotify.get_config(ROOT_PATH))
+    found, untagged = index.rebuild(root)
+    print(f'###   INDEXED {found} SONGS FROM {root}   ###')
+    if untagged:
+        # Only mp3 files carry the track id tag, and only since the library index was added
+        print(f'###   SKIPPED {untagged} FILES WITHOUT A TRACK ID TAG - THEY ARE INDEXED '
+              f'WHEN THEIR COLLECTION IS DOWNLOADED AGAIN   ###')
+
+
+def process_sysargs_input():  # pylint: disable=R0912
     """Process the sysargs given by the user"""
     if sys.argv[1] == '-p' or sys.argv[1] == '--playlist':
         download_from_user_playlist()
+    elif sys.argv[1] == '-s' or sys.argv[1] == '--sync':
+        if len(sys.argv) > 2:
+            _, _, playlist_id, _, _, _ = regex_input_for_urls(sys.argv[2])
+            if not playlist_id:
+                raise ValueError('Only playlists can be synced.')
+            sync_playlist(playlist_id)
+        else:
+            for playlist in get_all_playlists():
+                sync_playlist(playlist[ID])
+    elif sys.argv[1] == '-b' or sys.argv[1] == '--batch':
+        if len(sys.argv) < 3:
+            raise ValueError('A file of urls is needed for a batch.')
+        run_batch(sys.argv[2])
+    elif sys.argv[1] == '--coordinator':
+        if len(sys.argv) < 3:
+            raise ValueError('A file of urls is needed for a batch.')
+        run_coordinator(sys.argv[2])
+    elif sys.argv[1] == '--daemon':
+        run_daemon()
     elif sys.argv[1] == '-ls' or sys.argv[1] == '--liked-songs':
-        for song in get_saved_tracks():
-            if not song[TRACK][NAME]:
-                print(
-                    '###   SKIPPING:  SONG DOES NOT EXIST ON SPOTIFY ANYMORE   ###')
-            else:
-                download_track(song[TRACK][ID], 'Liked Songs/')
-            print('\n')
+        download_tracks(iter_saved_track_ids(), 'Liked Songs/', desc='Liked Songs')
     else:
         process_url_input(sys.argv[1])
 
 
+def read_batch_file(batch_file) -> List[str]:
+    """Returns the urls and uris of a batch file, one per line, skipping blanks and comments"""
+    with open(batch_file, encoding='utf-8') as file:
+        return [line.strip() for line in file
+                if line.strip() and not line.strip().startswith('#')]
+
+
+def get_job_queue() -> JobQueue:
+    """Opens the batch job queue at JOB_QUEUE_PATH"""
+    return JobQueue(os.path.join(os.path.dirname(__file__), ZSpotify.get_config(JOB_QUEUE_PATH)))
+
+
+def run_batch(batch_file):
+    """Downloads every url of batch_file through the job queue"""
+    # The urls are expanded into one job per track or episode by process_url_input, then
+    # MAX_CONCURRENT_DOWNLOADS workers run the jobs. Running the same batch again continues it.
+    queue = get_job_queue()
+    print(f'###   {queue.add_sources(read_batch_file(batch_file))} NEW URLS IN BATCH   ###')
+    requeued = queue.requeue_running()
+    if requeued:
+        print(f'###   RESUMING {requeued} INTERRUPTED JOBS   ###')
+    expand_batch_sources(queue)
+    workers = max(1, int(ZSpotify.get_config(MAX_CONCURRENT_DOWNLOADS)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in range(workers):
+            executor.submit(run_jobs, queue)
+    print_job_counts(queue)
+
+
+def print_job_counts(queue: JobQueue):
+    """Prints how many jobs are in each state"""
+    print('\n###   ' + ', '.join(f'{state}: {count}'
+                                 for state, count in queue.counts().items()) + '   ###')
+
+
+def run_coordinator(batch_file):
+    """Expands the urls of batch_file into the shared job queue for --worker processes"""
+    # The workers may run on this host or others sharing the queue file, this reports until every
+    # job finished
+    queue = get_job_queue()
+    print(f'###   {queue.add_sources(read_batch_file(batch_file))} NEW URLS IN BATCH   ###')
+    expand_batch_sources(queue)
+    while not queue.is_drained():
+        print_job_counts(queue)
+        time.sleep(COORDINATOR_REPORT_SECONDS)
+    print_job_counts(queue)
+
+
+def run_workers(count):
+    """Runs count worker processes, each with its own session"""
+    if count <= 1:
+        run_worker()
+        return
+    context = multiprocessing.get_context('spawn')
+    # Spawned processes start from a fresh ZSpotify, so --no-cache is handed down
+    processes = [context.Process(target=run_worker, args=(ZSpotify.RESPONSE_CACHE_BYPASS,))
+                 for _ in range(count)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+def run_worker(bypass_cache=False):
+    """Logs in and runs jobs of the shared job queue until it is drained"""
+    # Each job is leased for JOB_LEASE_SECONDS and renewed while it runs. The job of a worker that
+    # dies goes back to the queue once its lease runs out.
+    if bypass_cache:
+        ZSpotify.RESPONSE_CACHE_BYPASS = True
+    login()
+    queue = get_job_queue()
+    owner = f'{socket.gethostname()}:{os.getpid()}'
+    lease_seconds = ZSpotify.get_config(JOB_LEASE_SECONDS)
+    try:
+        while True:
+            job = queue.claim(owner, lease_seconds)
+            if job is None:
+                # A worker started before the coordinator added its urls waits for them
+                if queue.is_drained() and not queue.is_empty():
+                    return
+                time.sleep(WORKER_POLL_SECONDS)
+                continue
+            finished = threading.Event()
+            heartbeat = threading.Thread(target=renew_lease, daemon=True,
+                                         args=(queue, job[0], owner, lease_seconds, finished))
+            heartbeat.start()
+            try:
+                run_job(queue, job, owner)
+            finally:
+                finished.set()
+                heartbeat.join()
+    finally:
+        # Every worker process keeps its own timings
+        write_metrics_summary(f'.{os.getpid()}')
+
+
+# pylint: disable=R0913
+def renew_lease(queue: JobQueue, job_id, owner, lease_seconds, finished: threading.Event):
+    """Renews the lease of a job a third of the way through it until finished is set"""
+    while not finished.wait(lease_seconds / 3):
+        if not queue.renew(job_id, owner, lease_seconds):
+            print(f'###   LEASE OF JOB {job_id} WAS LOST   ###')
+            return
+
+
+def run_daemon():
+    """Keeps this session logged in and serves download jobs on DAEMON_HOST:DAEMON_PORT"""
+    daemon = DownloadDaemon(get_job_queue(), expand_batch_sources, run_job,
+                            int(ZSpotify.get_config(MAX_CONCURRENT_DOWNLOADS)),
+                            metrics=ZSpotify.METRICS)
+    daemon.serve(ZSpotify.get_config(DAEMON_HOST), int(ZSpotify.get_config(DAEMON_PORT)))
+
+
+def expand_batch_sources(queue: JobQueue, retry_failed=True):
+    """Expands the urls not expanded yet into jobs"""
+    # A url that fails is marked failed and the others go on
+    for url in queue.pending_sources(retry_failed):
+        queue.set_source_state(url, JobState.RUNNING)
+        queue.source = url
+        ZSpotify.set_job_sink(queue)
+        try:
+            process_url_input(url, call_search=False)
+        except Exception as error:  # pylint: disable=W0703
+            print('###   SKIPPING:', url, f'(EXPANSION ERROR: {error})   ###')
+            queue.set_source_state(url, JobState.FAILED, repr(error))
+        else:
+            queue.set_source_state(url, JobState.DONE)
+        finally:
+            ZSpotify.set_job_sink(None)
+            queue.source = None
+
+
+def run_jobs(queue: JobQueue):
+    """Runs queued jobs until none is left"""
+    while True:
+        job = queue.claim()
+        if job is None:
+            return
+        run_job(queue, job)
+
+
+def run_job(queue: JobQueue, job, owner=None):
+    """Downloads the track or episode of a claimed job and records how it went"""
+    job_id, kind, content_id, extra_paths, prefix_value, info = job
+    try:
+        if kind == JobKind.EPISODE:
+            status = download_episode(content_id, info)
+        else:
+            status = download_track(content_id, extra_paths, prefix=bool(prefix_value),
+                                    prefix_value=prefix_value, disable_progressbar=True,
+                                    track_info=info)
+        error = status.value if status in JOB_FAILURES else None
+    except Exception as exception:  # pylint: disable=W0703
+        error = repr(exception)
+    queue.finish(job_id, error, max(1, int(ZSpotify.get_config(MAX_JOB_ATTEMPTS))), owner)
+
+
 def process_url_input(url, call_search=True):
     """Process the url input and calls appropriate method for downloading"""
     track_id, album_id, playlist_id, episode_id, show_id, artist_id = regex_input_for_urls(url)
@@ -67,17 +302,12 @@ def process_url_input(url, call_search=True):
     elif album_id:
         download_album(album_id)
     elif playlist_id:
-        playlist_songs = get_playlist_songs(playlist_id)
         name, _ = get_playlist_info(playlist_id)
-        for song in playlist_songs:
-            download_track(song[TRACK][ID],
-                           sanitize_data(name) + '/')
-            print('\n')
+        download_tracks(iter_playlist_track_ids(playlist_id), sanitize_data(name) + '/', desc=name)
     elif episode_id:
         download_episode(episode_id)
     elif show_id:
-        for episode in get_show_episodes(show_id):
-            download_episode(episode)
+        download_show(show_id)
     elif call_search:
         search(url)
 
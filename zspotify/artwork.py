@@ -0,0 +1,84 @@
+"""This module provides the cover artwork cache shared by all tracks of a run"""
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+from PIL import Image
+
+
+def downscale_artwork(image: bytes, max_size: int) -> bytes:
+    """Returns the image shrunk to fit max_size x max_size, or unchanged if it already fits"""
+    with Image.open(io.BytesIO(image)) as img:
+        if max(img.size) <= max_size:
+            return image
+        img = img.convert('RGB')
+        img.thumbnail((max_size, max_size))
+        output = io.BytesIO()
+        img.save(output, format='JPEG', quality=90)
+        return output.getvalue()
+
+
+class ArtworkCache:
+    """LRU of artwork bytes keyed by image url, backed by an optional on-disk directory"""
+
+    def __init__(self, fetch: Callable[[str], bytes], max_entries=64, directory=None,
+                 max_size=0):
+        self.fetch = fetch
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.url_locks = {}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, image_url) -> bytes:
+        """Returns the artwork for image_url, fetching and downscaling it at most once"""
+        with self.lock:
+            if image_url in self.entries:
+                self.entries.move_to_end(image_url)
+                return self.entries[image_url]
+            url_lock = self.url_locks.setdefault(image_url, threading.Lock())
+
+        # Tracks of the same album wait here for the first one to fetch the artwork
+        with url_lock:
+            with self.lock:
+                if image_url in self.entries:
+                    return self.entries[image_url]
+            image = self.load(image_url)
+            if image is None:
+                image = self.fetch(image_url)
+                if self.max_size:
+                    image = downscale_artwork(image, self.max_size)
+                self.store(image_url, image)
+            with self.lock:
+                self.entries[image_url] = image
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                self.url_locks.pop(image_url, None)
+            return image
+
+    def path(self, image_url) -> str:
+        """Returns the on-disk location of the artwork for image_url"""
+        key = hashlib.sha1(f'{image_url}@{self.max_size}'.encode()).hexdigest()
+        return os.path.join(self.directory, key)
+
+    def load(self, image_url):
+        """Returns the artwork stored on disk, or None"""
+        if not self.directory or not os.path.isfile(self.path(image_url)):
+            return None
+        with open(self.path(image_url), 'rb') as file:
+            return file.read()
+
+    def store(self, image_url, image: bytes) -> None:
+        """Writes the artwork to disk, through a temporary file so readers never see half of it"""
+        if not self.directory:
+            return
+        temp_path = f'{self.path(image_url)}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as file:
+            file.write(image)
+        os.replace(temp_path, self.path(image_url))
@@ -0,0 +1,78 @@
+"""This module provides the on-disk cache of Web API responses"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+from urllib.parse import urlsplit
+
+
+class ResponseCache:
+    """SQLite store of Web API response bodies with per-endpoint TTLs, ETags and a size cap"""
+
+    def __init__(self, path, ttls: dict, max_bytes: int):
+        self.ttls = sorted(ttls.items(), key=lambda item: len(item[0]), reverse=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, url TEXT NOT NULL, body TEXT NOT NULL, etag TEXT, '
+                'size INTEGER NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)')
+
+    def get_ttl(self, url) -> Optional[float]:
+        """Returns the TTL of the endpoint serving url, the longest matching path prefix wins"""
+        # None means the endpoint is not cached, 0 that every use is revalidated with its ETag
+        path = urlsplit(url).path
+        for prefix, ttl in self.ttls:
+            if path.startswith(prefix):
+                return ttl
+        return None
+
+    @staticmethod
+    def get_key(url, params=None, account=None) -> str:
+        """Returns the cache key of a request, made by account when its answer depends on it"""
+        return hashlib.sha1(json.dumps([url, sorted((params or {}).items()), account],
+                                       default=str).encode()).hexdigest()
+
+    def get(self, key) -> Optional[Tuple[str, Optional[str], bool]]:
+        """Returns (body, etag, fresh) of a cached response, or None"""
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                'SELECT body, etag, expires FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute('UPDATE responses SET accessed = ? WHERE key = ?',
+                                    (time.time(), key))
+        body, etag, expires = row
+        return body, etag, time.time() < expires
+
+    def put(self, key, url, body, etag, ttl) -> None:
+        """Stores a response and evicts the least recently used ones above the size cap"""
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, url, body, etag, len(body), now + ttl, now))
+            total, = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses') \
+                .fetchone()
+            if total > self.max_bytes:
+                rows = self.connection.execute(
+                    'SELECT key, size FROM responses ORDER BY accessed').fetchall()
+                evicted = []
+                for old_key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append((old_key,))
+                    total -= size
+                self.connection.executemany('DELETE FROM responses WHERE key = ?', evicted)
+
+    def refresh(self, key, ttl) -> None:
+        """Extends a cached response the server confirmed as unchanged"""
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                'UPDATE responses SET expires = ?, accessed = ? WHERE key = ?',
+                (now + ttl, now, key))
@@ -21,12 +21,22 @@ ARTISTS = 'artists'
 
 ARTWORK = 'artwork'
 
+COMMENT = 'comment'
+
 TRACKS = 'tracks'
 
 TRACK = 'track'
 
 ITEMS = 'items'
 
+EPISODES = 'episodes'
+
+TOTAL = 'total'
+
+NEXT = 'next'
+
+INCLUDE_GROUPS = 'include_groups'
+
 NAME = 'name'
 
 ID = 'id'
@@ -35,6 +45,12 @@ URL = 'url'
 
 RELEASE_DATE = 'release_date'
 
+ALBUM_TYPE = 'album_type'
+
+EXTERNAL_IDS = 'external_ids'
+
+ISRC = 'isrc'
+
 IMAGES = 'images'
 
 LIMIT = 'limit'
@@ -43,6 +59,16 @@ OFFSET = 'offset'
 
 AUTHORIZATION = 'Authorization'
 
+ACCEPT_ENCODING = 'Accept-Encoding'
+
+RETRY_AFTER = 'Retry-After'
+
+IF_NONE_MATCH = 'If-None-Match'
+
+ETAG = 'ETag'
+
+MARKET_FROM_TOKEN = 'from_token'
+
 IS_PLAYABLE = 'is_playable'
 
 TRACK_NUMBER = 'track_number'
@@ -63,6 +89,8 @@ OWNER = 'owner'
 
 DISPLAY_NAME = 'display_name'
 
+SNAPSHOT_ID = 'snapshot_id'
+
 ALBUMS = 'albums'
 
 TYPE = 'type'
@@ -83,6 +111,10 @@ ROOT_PATH = 'ROOT_PATH'
 
 ROOT_PODCAST_PATH = 'ROOT_PODCAST_PATH'
 
+PODCAST_NEWEST_EPISODES = 'PODCAST_NEWEST_EPISODES'
+
+PODCAST_SINCE_DATE = 'PODCAST_SINCE_DATE'
+
 SKIP_EXISTING_FILES = 'SKIP_EXISTING_FILES'
 
 DOWNLOAD_FORMAT = 'DOWNLOAD_FORMAT'
@@ -97,6 +129,64 @@ CHUNK_SIZE = 'CHUNK_SIZE'
 
 SPLIT_ALBUM_DISCS = 'SPLIT_ALBUM_DISCS'
 
+MAX_CONCURRENT_DOWNLOADS = 'MAX_CONCURRENT_DOWNLOADS'
+
+ARTIST_ALBUM_GROUPS = 'ARTIST_ALBUM_GROUPS'
+
+TRANSCODE_WORKERS = 'TRANSCODE_WORKERS'
+
+TRANSCODE_QUEUE_SIZE = 'TRANSCODE_QUEUE_SIZE'
+
+STREAMING_TRANSCODE = 'STREAMING_TRANSCODE'
+
+ARTWORK_CACHE_SIZE = 'ARTWORK_CACHE_SIZE'
+
+ARTWORK_CACHE_PATH = 'ARTWORK_CACHE_PATH'
+
+ARTWORK_MAX_SIZE = 'ARTWORK_MAX_SIZE'
+
+LIBRARY_INDEX_PATH = 'LIBRARY_INDEX_PATH'
+
+CONTENT_STORE_PATH = 'CONTENT_STORE_PATH'
+
+JOB_QUEUE_PATH = 'JOB_QUEUE_PATH'
+
+MAX_JOB_ATTEMPTS = 'MAX_JOB_ATTEMPTS'
+
+JOB_LEASE_SECONDS = 'JOB_LEASE_SECONDS'
+
+DAEMON_HOST = 'DAEMON_HOST'
+
+CREDENTIAL_FILES = 'CREDENTIAL_FILES'
+
+DAEMON_PORT = 'DAEMON_PORT'
+
+DUPLICATE_POLICY = 'DUPLICATE_POLICY'
+
+SYNC_REMOVE_DELETED = 'SYNC_REMOVE_DELETED'
+
+PAGINATION_CONCURRENCY = 'PAGINATION_CONCURRENCY'
+
+ASYNC_ENGINE = 'ASYNC_ENGINE'
+
+ASYNC_API_CONCURRENCY = 'ASYNC_API_CONCURRENCY'
+
+METRICS_SUMMARY_PATH = 'METRICS_SUMMARY_PATH'
+
+RESPONSE_CACHE_PATH = 'RESPONSE_CACHE_PATH'
+
+RESPONSE_CACHE_TTLS = 'RESPONSE_CACHE_TTLS'
+
+RESPONSE_CACHE_MAX_MB = 'RESPONSE_CACHE_MAX_MB'
+
+HTTP_POOL_SIZE = 'HTTP_POOL_SIZE'
+
+HTTP_TIMEOUT = 'HTTP_TIMEOUT'
+
+API_RATE_LIMIT = 'API_RATE_LIMIT'
+
+MAX_RETRIES = 'MAX_RETRIES'
+
 DURATION_MS = 'duration_ms'
 
 ARTIST_ID = 'ArtistID'
@@ -114,11 +204,49 @@ TRACK_ID = 'TrackID'
 CONFIG_DEFAULT_SETTINGS = {
     'ROOT_PATH': '../ZSpotify Music/',
     'ROOT_PODCAST_PATH': '../ZSpotify Podcasts/',
+    'PODCAST_NEWEST_EPISODES': 0,
+    'PODCAST_SINCE_DATE': '',
     'SKIP_EXISTING_FILES': True,
     'DOWNLOAD_FORMAT': 'mp3',
     'FORCE_PREMIUM': False,
     'ANTI_BAN_WAIT_TIME': 1,
     'OVERRIDE_AUTO_WAIT': False,
     'CHUNK_SIZE': 50000,
-    'SPLIT_ALBUM_DISCS': False
+    'SPLIT_ALBUM_DISCS': False,
+    'MAX_CONCURRENT_DOWNLOADS': 1,
+    'ARTIST_ALBUM_GROUPS': 'album,single,compilation,appears_on',
+    'TRANSCODE_WORKERS': 0,
+    'TRANSCODE_QUEUE_SIZE': 0,
+    'STREAMING_TRANSCODE': False,
+    'ARTWORK_CACHE_SIZE': 64,
+    'ARTWORK_CACHE_PATH': '../.zs_artwork_cache/',
+    'ARTWORK_MAX_SIZE': 0,
+    'LIBRARY_INDEX_PATH': '../zs_library.db',
+    'SYNC_REMOVE_DELETED': False,
+    'CONTENT_STORE_PATH': '',
+    'JOB_QUEUE_PATH': '../zs_jobs.db',
+    'MAX_JOB_ATTEMPTS': 3,
+    'JOB_LEASE_SECONDS': 300,
+    'DAEMON_HOST': '127.0.0.1',
+    'CREDENTIAL_FILES': [],
+    'DAEMON_PORT': 4380,
+    'DUPLICATE_POLICY': 'keep_all',
+    'PAGINATION_CONCURRENCY': 4,
+    'ASYNC_ENGINE': False,
+    'ASYNC_API_CONCURRENCY': 8,
+    'METRICS_SUMMARY_PATH': '',
+    'RESPONSE_CACHE_PATH': '',
+    'RESPONSE_CACHE_TTLS': {
+        '/v1/tracks': 7 * 24 * 3600,
+        '/v1/albums': 7 * 24 * 3600,
+        '/v1/artists': 24 * 3600,
+        '/v1/episodes': 24 * 3600,
+        '/v1/shows': 3600,
+        '/v1/playlists': 0
+    },
+    'RESPONSE_CACHE_MAX_MB': 256,
+    'HTTP_POOL_SIZE': 10,
+    'HTTP_TIMEOUT': 30,
+    'API_RATE_LIMIT': 10,
+    'MAX_RETRIES': 5
 }
@@ -0,0 +1,171 @@
+"""This module provides the daemon mode serving download jobs over a local HTTP endpoint"""
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+from jobqueue import JobQueue, JobState
+from metrics import Metrics
+
+JOB_PATH_REGEX = re.compile(r'^/jobs/(?P<JobID>\d+)(?P<Progress>/progress)?/?$')
+
+# A submission is finished once its url is expanded and none of its jobs is left to run
+FINISHED_SOURCE_STATES = (JobState.DONE.value, JobState.FAILED.value, JobState.CANCELLED.value)
+ACTIVE_JOB_STATES = (JobState.PENDING.value, JobState.RUNNING.value)
+
+
+def is_finished(source: dict) -> bool:
+    """Returns whether a submission has nothing left to do"""
+    return source['state'] in FINISHED_SOURCE_STATES and \
+        not any(source['jobs'].get(state) for state in ACTIVE_JOB_STATES)
+
+
+class DownloadDaemon:  # pylint: disable=R0902
+    """Runs the jobs of the urls submitted to its HTTP server on background threads"""
+    # The endpoints are listed in the README
+
+    # pylint: disable=R0913
+    def __init__(self, queue: JobQueue, expand: Callable, run_job: Callable, workers=1,
+                 poll_interval=1.0, metrics: Metrics = None):
+        self.queue = queue
+        self.expand = expand
+        self.run_job = run_job
+        self.metrics = metrics or Metrics()
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.stopped = threading.Event()
+        self.wakeup = threading.Event()
+        self.threads = []
+
+    def expand_loop(self) -> None:
+        """Expands new submissions as they come in"""
+        while not self.stopped.is_set():
+            self.expand(self.queue, retry_failed=False)
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+
+    def work_loop(self) -> None:
+        """Runs jobs, polling the queue while it is empty"""
+        while not self.stopped.is_set():
+            job = self.queue.claim()
+            if job is None:
+                self.stopped.wait(self.poll_interval)
+            else:
+                self.run_job(self.queue, job)
+
+    def start(self) -> None:
+        """Starts the expansion thread and the workers"""
+        self.queue.requeue_running()
+        self.threads = [threading.Thread(target=self.expand_loop, daemon=True)]
+        self.threads += [threading.Thread(target=self.work_loop, daemon=True)
+                         for _ in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """Lets the threads finish their current job and waits for them"""
+        self.stopped.set()
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join()
+
+    def serve(self, host, port) -> None:
+        """Serves the HTTP endpoint until interrupted"""
+        server = ThreadingHTTPServer((host, port), self.make_handler())
+        self.start()
+        print(f'###   SERVING DOWNLOAD JOBS ON http://{host}:{port}/jobs   ###')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stop()
+
+    def make_handler(self):  # pylint: disable=R0915
+        """Returns the request handler class bound to this daemon"""
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Answers the job endpoints"""
+
+            def send_json(self, status, body) -> None:
+                """Sends body as a JSON response"""
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):  # pylint: disable=C0103
+                """Submits a url"""
+                if self.path.rstrip('/') != '/jobs':
+                    self.send_json(404, {'error': 'not found'})
+                    return
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                try:
+                    url = json.loads(body)['url'].strip()
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    self.send_json(400, {'error': 'expected {"url": ...}'})
+                    return
+                source_id = daemon.queue.submit(url)
+                daemon.wakeup.set()
+                self.send_json(202, {'id': source_id})
+
+            def do_GET(self):  # pylint: disable=C0103
+                """Lists submissions, reports one or streams its progress, or the metrics"""
+                if self.path.rstrip('/') == '/metrics':
+                    self.send_metrics()
+                    return
+                if self.path.rstrip('/') == '/jobs':
+                    self.send_json(200, daemon.queue.list_sources())
+                    return
+                match = JOB_PATH_REGEX.match(self.path)
+                source = daemon.queue.get_source(int(match.group('JobID'))) if match else None
+                if source is None:
+                    self.send_json(404, {'error': 'not found'})
+                elif match.group('Progress'):
+                    self.stream_progress(source)
+                else:
+                    self.send_json(200, source)
+
+            def do_DELETE(self):  # pylint: disable=C0103
+                """Cancels a submission"""
+                match = JOB_PATH_REGEX.match(self.path)
+                if match is None or match.group('Progress') or \
+                        not daemon.queue.cancel_source(int(match.group('JobID'))):
+                    self.send_json(404, {'error': 'not found'})
+                    return
+                self.send_json(200, daemon.queue.get_source(int(match.group('JobID'))))
+
+            def send_metrics(self) -> None:
+                """Sends the metrics for a Prometheus scrape"""
+                payload = daemon.metrics.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def stream_progress(self, source) -> None:
+                """Writes the submission as a JSON line whenever it changes until it is finished"""
+                self.close_connection = True
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.end_headers()
+                last = None
+                while True:
+                    if source != last:
+                        self.wfile.write(json.dumps(source).encode() + b'\n')
+                        self.wfile.flush()
+                        last = source
+                    if is_finished(source) or daemon.stopped.wait(daemon.poll_interval):
+                        return
+                    source = daemon.queue.get_source(source['id'])
+
+            def log_message(self, format, *args):  # pylint: disable=W0622
+                """Keeps the request log out of the download output"""
+
+        return Handler
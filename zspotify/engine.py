@@ -0,0 +1,149 @@
+"""This module provides the asyncio download engine"""
+# Metadata requests are awaited through the async Web API methods of ZSpotify while blocking
+# librespot stream reads run on a thread pool bounded by a semaphore and transcodes on the
+# process pool of TranscodePipeline
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import List, Tuple
+
+from const import ASYNC_ENGINE, MAX_CONCURRENT_DOWNLOADS
+from jobqueue import JobKind
+from track import CollectionDownload, download_track, get_songs_info, get_songs_url, \
+    parse_songs_response, TRACKS_BATCH_SIZE
+from track import download_tracks as download_tracks_blocking
+from utils import DownloadStatus, chunked
+from zspotify import ZSpotify
+
+
+async def aiter_batches(track_ids, size):
+    """Yields lists of size ids from a sync or async iterable"""
+    # A sync generator may page through the Web API, so it is advanced on a worker thread
+    if hasattr(track_ids, '__aiter__'):
+        batch = []
+        async for track_id in track_ids:
+            batch.append(track_id)
+            if len(batch) == size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+        return
+    iterator = iter(track_ids)
+    while True:
+        batch = await asyncio.to_thread(lambda: list(islice(iterator, size)))
+        if not batch:
+            return
+        yield batch
+
+
+class DownloadEngine:
+    """Downloads collections of tracks on an event loop"""
+
+    def __init__(self, stream_concurrency=0):
+        self.stream_concurrency = stream_concurrency or \
+            max(1, int(ZSpotify.get_config(MAX_CONCURRENT_DOWNLOADS)))
+        self.streams = asyncio.Semaphore(self.stream_concurrency)
+        self.stream_executor = ThreadPoolExecutor(max_workers=self.stream_concurrency)
+
+    async def run_stream(self, func, *args, **kwargs):
+        """Runs a blocking stream stage on the stream pool once a stream slot is free"""
+        async with self.streams:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.stream_executor, functools.partial(func, *args, **kwargs))
+
+    @staticmethod
+    async def get_songs_info(song_ids) -> dict:
+        """Awaitable get_songs_info, its batch requests are all sent at once"""
+        song_ids = list(dict.fromkeys(song_ids))
+        batches = list(chunked(song_ids, TRACKS_BATCH_SIZE))
+        responses = await asyncio.gather(*(ZSpotify.invoke_url_async(get_songs_url(batch))
+                                           for batch in batches), return_exceptions=True)
+        songs_info = {}
+        for batch, info in zip(batches, responses):
+            # Like get_songs_info, the songs of a failed batch are looked up one by one
+            if not isinstance(info, Exception):
+                songs_info.update(parse_songs_response(batch, info))
+        return songs_info
+
+    # pylint: disable=R0913, R0914
+    async def download_tracks(self, track_ids, extra_paths='', prefix=False, desc=None,
+                              songs_info=None, total=None, skip=(),
+                              duplicates=None) -> List[Tuple[str, DownloadStatus]]:
+        """Downloads a collection on the asyncio engine"""
+        # The metadata of the next batch is requested while the stream pool works through the
+        # current one
+        pending = {}
+
+        def collect(tasks):
+            for task in tasks:
+                collection.finished(pending.pop(task), task.result())
+
+        with CollectionDownload(extra_paths, prefix, desc, songs_info, total, skip,
+                                duplicates) as collection:
+            async for batch in aiter_batches(track_ids, TRACKS_BATCH_SIZE):
+                batch_info = await self.get_songs_info(
+                    await asyncio.to_thread(collection.get_missing_ids, batch))
+                downloads = await asyncio.to_thread(collection.plan_batch, batch, batch_info)
+                for position, arguments in downloads:
+                    task = asyncio.ensure_future(self.run_stream(download_track, **arguments))
+                    pending[task] = position
+                    while len(pending) >= self.stream_concurrency * 2:
+                        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        collect(done)
+            if pending:
+                done, _ = await asyncio.wait(pending)
+                collect(done)
+            # Waiting for the queued transcodes blocks, keep the loop free meanwhile
+            await asyncio.to_thread(collection.close)
+
+        return collection.get_results()
+
+    def close(self) -> None:
+        """Shuts the stream pool down"""
+        self.stream_executor.shutdown(wait=True)
+
+
+async def download_tracks_async(*args, **kwargs) -> List[Tuple[str, DownloadStatus]]:
+    """Runs DownloadEngine.download_tracks on an engine of its own"""
+    engine = DownloadEngine()
+    try:
+        return await engine.download_tracks(*args, **kwargs)
+    finally:
+        engine.close()
+
+
+# pylint: disable=R0913, W0613
+def queue_tracks(track_ids, extra_paths='', prefix=False, desc=None, songs_info=None,
+                 total=None, skip=(), duplicates=None) -> List[Tuple[str, DownloadStatus]]:
+    """Queues a collection on the job sink of the current thread as one job per track"""
+    # Jobs are numbered by position like download_tracks would and duplicates picked beforehand
+    # are left out. The metadata is fetched TRACKS_BATCH_SIZE tracks per request and stored with
+    # the jobs, so workers do not look each track up on their own.
+    results = []
+    for batch in chunked(track_ids, TRACKS_BATCH_SIZE):
+        queued = [track_id for track_id in batch
+                  if track_id not in skip and not (duplicates and track_id in duplicates)]
+        batch_info = songs_info if songs_info is not None else get_songs_info(queued)
+        for track_id in batch:
+            if track_id not in queued:
+                results.append((track_id, DownloadStatus.SKIPPED))
+                continue
+            ZSpotify.get_job_sink().add_job(JobKind.TRACK, track_id, extra_paths,
+                                            str(len(results) + 1) if prefix else '',
+                                            batch_info.get(track_id))
+            results.append((track_id, DownloadStatus.QUEUED))
+    print(f'###   QUEUED {len(results)} SONGS FROM {desc or extra_paths}   ###')
+    return results
+
+
+def download_tracks(*args, **kwargs) -> List[Tuple[str, DownloadStatus]]:
+    """Downloads a collection, or queues it as jobs while a batch is expanded"""
+    # Runs on the asyncio engine when ASYNC_ENGINE is set, otherwise on the thread pool of
+    # track.download_tracks
+    if ZSpotify.get_job_sink() is not None:
+        return queue_tracks(*args, **kwargs)
+    if not ZSpotify.get_config(ASYNC_ENGINE):
+        return download_tracks_blocking(*args, **kwargs)
+    return asyncio.run(download_tracks_async(*args, **kwargs))
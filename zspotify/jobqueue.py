@@ -0,0 +1,264 @@
+"""This module provides the SQLite job queue behind batch downloads"""
+import json
+import sqlite3
+import threading
+import time
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+
+LOCK_TIMEOUT = 60
+
+
+class JobState(str, Enum):
+    """State of a batch source or job"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+
+
+class JobKind(str, Enum):
+    """What a job downloads"""
+    TRACK = 'track'
+    EPISODE = 'episode'
+
+
+class JobQueue:
+    """Durable queue of the urls of a batch and of the jobs they expand to"""
+    # Every state change is committed at once, so a restarted run picks up where the last one
+    # stopped
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.source = None
+        # Workers in other processes hold the database lock for a moment on every claim
+        self.connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS sources ('
+                'url TEXT PRIMARY KEY, state TEXT NOT NULL, error TEXT, updated REAL NOT NULL)')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, source TEXT, kind TEXT NOT NULL, '
+                'content_id TEXT NOT NULL, extra_paths TEXT NOT NULL, prefix_value TEXT NOT NULL, '
+                'state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, '
+                'updated REAL NOT NULL, lease_owner TEXT, lease_expires REAL, info TEXT, '
+                'UNIQUE (kind, content_id, extra_paths))')
+            columns = {column for _, column, *_ in
+                       self.connection.execute('PRAGMA table_info(jobs)').fetchall()}
+            for column, column_type in (('lease_owner', 'TEXT'), ('lease_expires', 'REAL'),
+                                        ('info', 'TEXT')):
+                if column not in columns:
+                    self.connection.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, updated)')
+            # A job can be wanted by several sources, the first one is kept in jobs.source
+            linked = self.connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'source_jobs'"
+            ).fetchone()
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS source_jobs ('
+                'source TEXT NOT NULL, job_id INTEGER NOT NULL, PRIMARY KEY (source, job_id))')
+            if linked is None:
+                self.connection.execute(
+                    'INSERT OR IGNORE INTO source_jobs SELECT source, id FROM jobs '
+                    'WHERE source IS NOT NULL')
+
+    def add_sources(self, urls) -> int:
+        """Queues urls for expansion and returns the number of new ones"""
+        # Urls already known keep their state
+        with self.lock, self.connection:
+            cursor = self.connection.executemany(
+                'INSERT OR IGNORE INTO sources VALUES (?, ?, NULL, ?)',
+                [(url, JobState.PENDING.value, time.time()) for url in urls])
+            return cursor.rowcount
+
+    def pending_sources(self, retry_failed=True) -> List[str]:
+        """Returns the urls still to expand, in the order they were added"""
+        # Those are the ones not expanded yet and the ones whose expansion was interrupted or failed
+        states = [JobState.PENDING.value, JobState.RUNNING.value]
+        if retry_failed:
+            states.append(JobState.FAILED.value)
+        with self.lock:
+            rows = self.connection.execute(
+                f'SELECT url FROM sources WHERE state IN ({",".join("?" * len(states))}) '
+                'ORDER BY rowid', states).fetchall()
+        return [url for url, in rows]
+
+    def submit(self, url) -> int:
+        """Queues url for expansion, again if it was expanded before, and returns its id"""
+        # Expanding again picks up new tracks of a collection. Its jobs that failed or were
+        # cancelled are queued again with fresh attempts.
+        with self.lock, self.connection:
+            now = time.time()
+            self.connection.execute(
+                'INSERT INTO sources VALUES (?, ?, NULL, ?) ON CONFLICT (url) DO UPDATE SET '
+                'state = excluded.state, error = NULL, updated = excluded.updated',
+                (url, JobState.PENDING.value, now))
+            self.connection.execute(
+                'UPDATE jobs SET state = ?, attempts = 0, error = NULL, updated = ? '
+                'WHERE state IN (?, ?) AND id IN (SELECT job_id FROM source_jobs WHERE source = ?)',
+                (JobState.PENDING.value, now, JobState.FAILED.value, JobState.CANCELLED.value,
+                 url))
+            source_id, = self.connection.execute(
+                'SELECT rowid FROM sources WHERE url = ?', (url,)).fetchone()
+        return source_id
+
+    def get_source(self, source_id) -> Optional[dict]:
+        """Returns the url, expansion state and job counts of a source, or None"""
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT rowid, url, state, error FROM sources WHERE rowid = ?',
+                (source_id,)).fetchone()
+            if row is None:
+                return None
+            jobs = dict(self.connection.execute(
+                'SELECT jobs.state, COUNT(*) FROM source_jobs JOIN jobs ON jobs.id = job_id '
+                'WHERE source_jobs.source = ? GROUP BY jobs.state', (row[1],)).fetchall())
+        return {'id': row[0], 'url': row[1], 'state': row[2], 'error': row[3], 'jobs': jobs}
+
+    def list_sources(self) -> List[dict]:
+        """Returns get_source for every source"""
+        with self.lock:
+            rows = self.connection.execute('SELECT rowid FROM sources ORDER BY rowid').fetchall()
+        return [self.get_source(source_id) for source_id, in rows]
+
+    def cancel_source(self, source_id) -> bool:
+        """Cancels a source and its jobs that did not start yet, False when it is unknown"""
+        # Running jobs finish and jobs another source still wants stay queued
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                'SELECT url FROM sources WHERE rowid = ?', (source_id,)).fetchone()
+            if row is None:
+                return False
+            now = time.time()
+            self.connection.execute(
+                'UPDATE sources SET state = ?, updated = ? WHERE rowid = ?',
+                (JobState.CANCELLED.value, now, source_id))
+            self.connection.execute(
+                'UPDATE jobs SET state = ?, updated = ? WHERE state = ? '
+                'AND id IN (SELECT job_id FROM source_jobs WHERE source = ?) '
+                'AND id NOT IN (SELECT job_id FROM source_jobs JOIN sources '
+                'ON sources.url = source_jobs.source '
+                'WHERE sources.url != ? AND sources.state != ?)',
+                (JobState.CANCELLED.value, now, JobState.PENDING.value, row[0], row[0],
+                 JobState.CANCELLED.value))
+        return True
+
+    def set_source_state(self, url, state: JobState, error=None) -> None:
+        """Updates the expansion state of a url, unless it was cancelled meanwhile"""
+        with self.lock, self.connection:
+            self.connection.execute(
+                'UPDATE sources SET state = ?, error = ?, updated = ? WHERE url = ? AND state != ?',
+                (state.value, error, time.time(), url, JobState.CANCELLED.value))
+
+    # pylint: disable=R0913
+    def add_job(self, kind: JobKind, content_id, extra_paths='', prefix_value='',
+                info=None) -> None:
+        """Queues a download for the source being expanded and links it to the source"""
+        # A job already queued for the same content and folder is shared, and queued again if it
+        # had been cancelled. Nothing is queued once the source was cancelled. info is the metadata
+        # fetched while expanding, handed back by claim so the download does not request it again.
+        with self.lock, self.connection:
+            if self.connection.execute(
+                    'SELECT 1 FROM sources WHERE url = ? AND state = ?',
+                    (self.source, JobState.CANCELLED.value)).fetchone() is not None:
+                return
+            self.connection.execute(
+                'INSERT INTO jobs (source, kind, content_id, extra_paths, prefix_value, state, '
+                'updated, info) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (kind, content_id, extra_paths) DO UPDATE SET '
+                'state = excluded.state, attempts = 0, error = NULL, updated = excluded.updated, '
+                'info = COALESCE(excluded.info, info) WHERE state = ?',
+                (self.source, kind.value, content_id, extra_paths, prefix_value,
+                 JobState.PENDING.value, time.time(),
+                 json.dumps(info) if info is not None else None, JobState.CANCELLED.value))
+            self.connection.execute(
+                'INSERT OR IGNORE INTO source_jobs SELECT ?, id FROM jobs '
+                'WHERE kind = ? AND content_id = ? AND extra_paths = ?',
+                (self.source, kind.value, content_id, extra_paths))
+
+    def claim(self, owner=None, lease_seconds=None) -> Optional[Tuple]:
+        """Marks the pending job waiting longest running and returns it, or None"""
+        # A job comes as (id, kind, content_id, extra_paths, prefix_value, info). One put back
+        # after a failure waits behind the ones queued before it. With an owner the job is leased
+        # to it for lease_seconds, jobs whose lease ran out because their worker died are claimable
+        # again.
+        with self.lock, self.connection:
+            # Take the write lock before reading so two processes never claim the same job
+            self.connection.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            self.connection.execute(
+                'UPDATE jobs SET state = ?, lease_owner = NULL, lease_expires = NULL, updated = ? '
+                'WHERE state = ? AND lease_expires < ?',
+                (JobState.PENDING.value, now, JobState.RUNNING.value, now))
+            row = self.connection.execute(
+                'SELECT id, kind, content_id, extra_paths, prefix_value, info FROM jobs '
+                'WHERE state = ? ORDER BY updated, id LIMIT 1',
+                (JobState.PENDING.value,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                'UPDATE jobs SET state = ?, attempts = attempts + 1, updated = ?, '
+                'lease_owner = ?, lease_expires = ? WHERE id = ?',
+                (JobState.RUNNING.value, now, owner,
+                 now + lease_seconds if owner is not None else None, row[0]))
+        return row[:5] + (json.loads(row[5]) if row[5] is not None else None,)
+
+    def renew(self, job_id, owner, lease_seconds) -> bool:
+        """Extends the lease of a running job, False when owner lost it meanwhile"""
+        with self.lock, self.connection:
+            return self.connection.execute(
+                'UPDATE jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND state = ?',
+                (time.time() + lease_seconds, job_id, owner, JobState.RUNNING.value)).rowcount > 0
+
+    def finish(self, job_id, error=None, max_attempts=1, owner=None) -> Optional[JobState]:
+        """Marks a job done, or failed once it used up max_attempts, and returns its state"""
+        # A failed job with attempts left goes back to pending. None is returned when the job was
+        # leased to owner and the lease went to another worker meanwhile.
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                'SELECT attempts, lease_owner, state FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if owner is not None and (row[1] != owner or row[2] != JobState.RUNNING.value):
+                return None
+            if error is None:
+                state = JobState.DONE
+            else:
+                state = JobState.FAILED if row[0] >= max_attempts else JobState.PENDING
+            self.connection.execute(
+                'UPDATE jobs SET state = ?, error = ?, updated = ?, lease_owner = NULL, '
+                'lease_expires = NULL WHERE id = ?', (state.value, error, time.time(), job_id))
+        return state
+
+    def is_drained(self) -> bool:
+        """Returns whether every url is expanded and no job is pending or running"""
+        with self.lock:
+            sources, = self.connection.execute(
+                'SELECT COUNT(*) FROM sources WHERE state IN (?, ?)',
+                (JobState.PENDING.value, JobState.RUNNING.value)).fetchone()
+            jobs, = self.connection.execute(
+                'SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)',
+                (JobState.PENDING.value, JobState.RUNNING.value)).fetchone()
+        return not sources and not jobs
+
+    def is_empty(self) -> bool:
+        """Returns whether no url was ever added"""
+        with self.lock:
+            sources, = self.connection.execute('SELECT COUNT(*) FROM sources').fetchone()
+        return not sources
+
+    def requeue_running(self) -> int:
+        """Puts the jobs a crashed run left running back to pending and counts them"""
+        # The attempt they used still counts, leased jobs are left to their lease
+        with self.lock, self.connection:
+            return self.connection.execute(
+                'UPDATE jobs SET state = ?, updated = ? WHERE state = ? AND lease_owner IS NULL',
+                (JobState.PENDING.value, time.time(), JobState.RUNNING.value)).rowcount
+
+    def counts(self) -> Dict[str, int]:
+        """Returns the number of jobs in each state"""
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        return dict(rows)
@@ -0,0 +1,176 @@
+"""This module provides the SQLite index of downloaded tracks, keyed by Spotify track id"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import music_tag
+
+from const import COMMENT
+
+AUDIO_EXTENSIONS = ('.mp3', '.ogg')
+
+TRACK_COMMENT_PREFIX = 'spotify:track:'
+
+TRACK_COMMENT_REGEX = re.compile(r'spotify:track:(?P<TrackID>[0-9a-zA-Z]{22})')
+
+# SQLite refuses statements with more than 999 parameters on older builds
+LOOKUP_BATCH_SIZE = 500
+
+
+def scan_audio_files(root) -> Iterator[str]:
+    """Yields the path of every downloaded audio file below root"""
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from scan_audio_files(entry.path)
+        elif entry.is_file() and entry.name.lower().endswith(AUDIO_EXTENSIONS):
+            yield entry.path
+
+
+def read_track_id(path) -> Optional[str]:
+    """Returns the Spotify track id stored in the comment tag of an audio file"""
+    try:
+        comment = str(music_tag.load_file(path)[COMMENT])
+    except Exception:  # pylint: disable=W0703
+        return None
+    match = TRACK_COMMENT_REGEX.search(comment)
+    return match.group('TrackID') if match else None
+
+
+class LibraryIndex:
+    """Persistent record of where every downloaded track lives"""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS tracks ('
+                'track_id TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER NOT NULL, '
+                'format TEXT, quality TEXT, updated REAL NOT NULL)')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS playlists ('
+                'playlist_id TEXT PRIMARY KEY, name TEXT, snapshot_id TEXT, updated REAL NOT NULL)')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS playlist_tracks ('
+                'playlist_id TEXT NOT NULL, position INTEGER NOT NULL, track_id TEXT NOT NULL, '
+                'PRIMARY KEY (playlist_id, position))')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS recordings ('
+                'track_id TEXT PRIMARY KEY, isrc TEXT NOT NULL)')
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS recordings_isrc ON recordings (isrc)')
+
+    def lookup(self, track_id) -> Optional[Tuple[str, int, str, str]]:
+        """Returns (path, size, format, quality) of an indexed track, or None"""
+        return self.lookup_many([track_id]).get(track_id)
+
+    def lookup_many(self, track_ids) -> Dict[str, Tuple[str, int, str, str]]:
+        """Returns (path, size, format, quality) for every indexed track among track_ids"""
+        track_ids = list(dict.fromkeys(track_ids))
+        found = {}
+        with self.lock:
+            for start in range(0, len(track_ids), LOOKUP_BATCH_SIZE):
+                batch = track_ids[start:start + LOOKUP_BATCH_SIZE]
+                rows = self.connection.execute(
+                    'SELECT track_id, path, size, format, quality FROM tracks '
+                    f'WHERE track_id IN ({",".join("?" * len(batch))})', batch)
+                for track_id, path, size, music_format, quality in rows:
+                    found[track_id] = (path, size, music_format, quality)
+        return found
+
+    def existing(self, track_ids, music_format) -> Dict[str, str]:
+        """Returns the path of every track among track_ids already on disk in music_format"""
+        return {track_id: path
+                for track_id, (path, _, indexed_format, _) in self.lookup_many(track_ids).items()
+                if indexed_format == music_format and os.path.isfile(path)
+                and os.path.getsize(path)}
+
+    def record(self, track_id, path, music_format, quality=None) -> None:
+        """Stores or replaces the location of a downloaded track"""
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?)',
+                (track_id, os.path.abspath(path), os.path.getsize(path), music_format, quality,
+                 time.time()))
+
+    def remove(self, track_id) -> None:
+        """Forgets a track"""
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM tracks WHERE track_id = ?', (track_id,))
+
+    def record_recordings(self, isrcs: Dict[str, str]) -> None:
+        """Stores the ISRC of every track id in isrcs"""
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO recordings VALUES (?, ?)', isrcs.items())
+
+    def find_recordings(self, isrcs, music_format) -> Dict[str, Tuple[str, str]]:
+        """Returns (track_id, path) of a copy in music_format of every recording among isrcs"""
+        isrcs = list(dict.fromkeys(isrcs))
+        found = {}
+        with self.lock:
+            for start in range(0, len(isrcs), LOOKUP_BATCH_SIZE):
+                batch = isrcs[start:start + LOOKUP_BATCH_SIZE]
+                rows = self.connection.execute(
+                    'SELECT recordings.isrc, tracks.track_id, tracks.path FROM recordings '
+                    'JOIN tracks ON tracks.track_id = recordings.track_id WHERE tracks.format = ? '
+                    f'AND recordings.isrc IN ({",".join("?" * len(batch))})',
+                    [music_format, *batch]).fetchall()
+                for isrc, track_id, path in rows:
+                    found.setdefault(isrc, (track_id, path))
+        return {isrc: (track_id, path) for isrc, (track_id, path) in found.items()
+                if os.path.isfile(path) and os.path.getsize(path)}
+
+    def rebuild(self, root) -> Tuple[int, int]:
+        """Indexes every tagged file below root and drops entries whose file is gone"""
+        # The number of files indexed and of files without a track id tag is returned
+        found = untagged = 0
+        for path in scan_audio_files(root):
+            track_id = read_track_id(path)
+            if not track_id:
+                untagged += 1
+                continue
+            music_format = os.path.splitext(path)[1][1:].lower()
+            indexed = self.lookup(track_id)
+            quality = indexed[3] if indexed else None
+            self.record(track_id, path, music_format, quality)
+            found += 1
+        with self.lock:
+            rows = self.connection.execute('SELECT track_id, path FROM tracks').fetchall()
+        for track_id, path in rows:
+            if not os.path.isfile(path):
+                self.remove(track_id)
+        return found, untagged
+
+    def get_playlist(self, playlist_id) -> Optional[Tuple[str, List[str]]]:
+        """Returns the snapshot id and track ids stored by the last sync of a playlist, or None"""
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT snapshot_id FROM playlists WHERE playlist_id = ?',
+                (playlist_id,)).fetchone()
+            if row is None:
+                return None
+            rows = self.connection.execute(
+                'SELECT track_id FROM playlist_tracks WHERE playlist_id = ? ORDER BY position',
+                (playlist_id,)).fetchall()
+        return row[0], [track_id for track_id, in rows]
+
+    def save_playlist(self, playlist_id, name, snapshot_id, track_ids) -> None:
+        """Replaces the stored snapshot id and track ids of a playlist"""
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO playlists VALUES (?, ?, ?, ?)',
+                (playlist_id, name, snapshot_id, time.time()))
+            self.connection.execute(
+                'DELETE FROM playlist_tracks WHERE playlist_id = ?', (playlist_id,))
+            self.connection.executemany(
+                'INSERT INTO playlist_tracks VALUES (?, ?, ?)',
+                [(playlist_id, position, track_id)
+                 for position, track_id in enumerate(track_ids)])
@@ -0,0 +1,128 @@
+"""This module provides the per-stage timing histograms and counters of a run"""
+import bisect
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+METRIC_PREFIX = 'zspotify'
+
+# Spotify ids in Web API paths are replaced so calls group by endpoint
+API_ID_REGEX = re.compile(r'/[0-9a-zA-Z]{22}(?=/|$)')
+
+
+def get_endpoint(path) -> str:
+    """Returns the Web API path with its ids replaced by {id}"""
+    return API_ID_REGEX.sub('/{id}', path)
+
+
+class Histogram:
+    """Counts observations into fixed buckets and keeps their sum and maximum"""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        """Adds one observation"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, fraction: float) -> float:
+        """Returns the upper bound of the bucket holding the given fraction of observations"""
+        # The bound is capped at the maximum seen
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(bound, round(self.max, 6))
+        return round(self.max, 6)
+
+
+class Metrics:
+    """Thread safe registry of stage latency histograms and labelled counters"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages: Dict[str, Histogram] = {}
+        self.counters: Dict[Tuple[str, Tuple], float] = {}
+
+    def observe(self, stage, seconds: float) -> None:
+        """Records how long one run of stage took"""
+        with self.lock:
+            self.stages.setdefault(stage, Histogram()).observe(seconds)
+
+    def observe_all(self, timings: dict) -> None:
+        """Records a {stage: seconds} dict, as measured in another process"""
+        for stage, seconds in timings.items():
+            self.observe(stage, seconds)
+
+    @contextmanager
+    def timed(self, stage):
+        """Records the time spent in the block under stage, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def increment(self, name, amount=1, **labels) -> None:
+        """Adds amount to the counter name with the given labels"""
+        # Label values are kept as strings, so a status code and 'cache' sort together
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def to_prometheus(self) -> str:
+        """Returns every metric in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            if self.stages:
+                name = f'{METRIC_PREFIX}_stage_seconds'
+                lines += [f'# HELP {name} Time spent in each download stage.',
+                          f'# TYPE {name} histogram']
+                for stage, histogram in sorted(self.stages.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                    lines.append(f'{name}_sum{{stage="{stage}"}} {histogram.sum}')
+                    lines.append(f'{name}_count{{stage="{stage}"}} {histogram.count}')
+            names = sorted({name for name, _ in self.counters})
+            for counter in names:
+                name = f'{METRIC_PREFIX}_{counter}_total'
+                lines.append(f'# TYPE {name} counter')
+                for (key, labels), value in sorted(self.counters.items()):
+                    if key == counter:
+                        label_text = ','.join(f'{label}="{label_value}"'
+                                              for label, label_value in labels)
+                        lines.append(f'{name}{{{label_text}}} {value}' if label_text
+                                     else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> dict:
+        """Returns the timings of every stage and the value of every counter"""
+        # Each stage has its count, total, mean, p50, p95 and max seconds
+        with self.lock:
+            stages = {stage: {'count': histogram.count,
+                              'total_seconds': round(histogram.sum, 6),
+                              'mean_seconds': round(histogram.sum / histogram.count, 6),
+                              'p50_seconds': histogram.quantile(0.5),
+                              'p95_seconds': histogram.quantile(0.95),
+                              'max_seconds': round(histogram.max, 6)}
+                      for stage, histogram in sorted(self.stages.items())}
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                label_text = ','.join(f'{label}={label_value}' for label, label_value in labels)
+                counters.setdefault(name, {})[label_text or 'total'] = value
+        return {'stages': stages, 'counters': counters}
@@ -1,9 +1,9 @@
 """This module provides the helper functions related playlists and downloading playlists"""
-from tqdm import tqdm
+import os
 
-from const import ITEMS, ID, TRACK, NAME
-from track import download_track
-from utils import sanitize_data
+from const import TOTAL, ID, TRACK, NAME, SNAPSHOT_ID, ROOT_PATH, SYNC_REMOVE_DELETED
+from engine import download_tracks
+from utils import sanitize_data, DownloadStatus
 from zspotify import ZSpotify
 
 MY_PLAYLISTS_URL = 'https://api.spotify.com/v1/me/playlists'
@@ -12,35 +12,7 @@ PLAYLISTS_URL = 'https://api.spotify.com/v1/playlists'
 
 def get_all_playlists():
     """ Returns list of users playlists """
-    playlists = []
-    limit = 50
-    offset = 0
-
-    while True:
-        resp = ZSpotify.invoke_url_with_params(MY_PLAYLISTS_URL, limit=limit, offset=offset)
-        offset += limit
-        playlists.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
-
-    return playlists
-
-
-def get_playlist_songs(playlist_id):
-    """ returns list of songs in a playlist """
-    playlist_songs = []
-    offset = 0
-    limit = 100
-
-    while True:
-        resp = ZSpotify.invoke_url_with_params(f'{PLAYLISTS_URL}/{playlist_id}/tracks',
-                                               limit=limit, offset=offset)
-        offset += limit
-        playlist_songs.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
-
-    return playlist_songs
+    return ZSpotify.invoke_url_paginated(MY_PLAYLISTS_URL, limit=50)
 
 
 def get_playlist_info(playlist_id):
@@ -50,15 +22,77 @@ def get_playlist_info(playlist_id):
     return resp['name'].strip(), resp['owner']['display_name'].strip()
 
 
+def get_playlist_snapshot(playlist_id):
+    """ Returns the name and snapshot id of a playlist """
+    resp = ZSpotify.invoke_url(f'{PLAYLISTS_URL}/{playlist_id}?fields=name,snapshot_id')
+    return resp[NAME].strip(), resp[SNAPSHOT_ID]
+
+
+def get_playlist_track_ids(playlist_id):
+    """ Returns the ids of the songs in a playlist, asking the API for nothing else """
+    return list(iter_playlist_track_ids(playlist_id))
+
+
+def iter_playlist_track_ids(playlist_id):
+    """ Yields the ids of the songs in a playlist as each page arrives """
+    for song in ZSpotify.iter_url_paginated(f'{PLAYLISTS_URL}/{playlist_id}/tracks', limit=100,
+                                            fields=f'items({TRACK}({ID})),{TOTAL}'):
+        if song[TRACK] and song[TRACK][ID]:
+            yield song[TRACK][ID]
+
+
+def sync_playlist(playlist_id):
+    """ Downloads the songs added to a playlist since its last sync """
+    # With SYNC_REMOVE_DELETED the songs removed from it are deleted as well
+    index = ZSpotify.get_library_index()
+    name, snapshot_id = get_playlist_snapshot(playlist_id)
+    if index is None:
+        print('###   LIBRARY INDEX IS DISABLED - DOWNLOADING THE WHOLE PLAYLIST   ###')
+        download_playlist({ID: playlist_id, NAME: name})
+        return
+
+    stored = index.get_playlist(playlist_id)
+    if stored is not None and stored[0] == snapshot_id:
+        print(f'###   {name} IS UP TO DATE   ###')
+        return
+
+    track_ids = list(dict.fromkeys(get_playlist_track_ids(playlist_id)))
+    previous = set(stored[1]) if stored is not None else set()
+    added = [track_id for track_id in track_ids if track_id not in previous]
+    removed = previous.difference(track_ids)
+    print(f'###   {name}: {len(added)} NEW, {len(removed)} REMOVED   ###')
+
+    playlist_folder = sanitize_data(name) + '/'
+    failed = set()
+    if added:
+        results = download_tracks(added, playlist_folder, desc=name)
+        failed = {track_id for track_id, status in results
+                  if status in (DownloadStatus.FAILED, DownloadStatus.METADATA_ERROR)}
+    if removed and ZSpotify.get_config(SYNC_REMOVE_DELETED):
+        remove_playlist_tracks(removed, playlist_folder)
+
+    # Failed songs are left out and the snapshot forgotten so the next sync retries them
+    index.save_playlist(playlist_id, name, None if failed else snapshot_id,
+                        [track_id for track_id in track_ids if track_id not in failed])
+
+
+def remove_playlist_tracks(track_ids, playlist_folder):
+    """ Deletes the files of the given songs that live inside the playlist folder """
+    index = ZSpotify.get_library_index()
+    folder = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                          ZSpotify.get_config(ROOT_PATH), playlist_folder))
+    for track_id, (path, _, _, _) in index.lookup_many(track_ids).items():
+        if os.path.commonpath([folder, path]) == folder:
+            if os.path.isfile(path):
+                os.remove(path)
+            index.remove(track_id)
+
+
 def download_playlist(playlist):
     """Downloads all the songs from a playlist"""
 
-    playlist_songs = [song for song in get_playlist_songs(playlist[ID]) if song[TRACK][ID]]
-    p_bar = tqdm(playlist_songs, unit='song', total=len(playlist_songs), unit_scale=True)
-    for song in p_bar:
-        download_track(song[TRACK][ID], sanitize_data(playlist[NAME].strip()) + '/',
-                       disable_progressbar=True)
-        p_bar.set_description(song[TRACK][NAME])
+    download_tracks(iter_playlist_track_ids(playlist[ID]),
+                    sanitize_data(playlist[NAME].strip()) + '/', desc=playlist[NAME].strip())
 
 
 def download_from_user_playlist():
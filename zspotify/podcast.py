@@ -1,16 +1,22 @@
 """This module provides helper function related to podcasts and downloading the podcasts"""
 import os
-from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, Optional, Tuple
 
 from librespot.metadata import EpisodeId
 from tqdm import tqdm
 
-from const import NAME, ERROR, SHOW, ITEMS, ID, ROOT_PODCAST_PATH, CHUNK_SIZE
-from utils import sanitize_data, create_download_directory, MusicFormat
+from const import NAME, ERROR, SHOW, ID, ROOT_PODCAST_PATH, EPISODES, RELEASE_DATE, \
+    SKIP_EXISTING_FILES, MAX_CONCURRENT_DOWNLOADS, PODCAST_NEWEST_EPISODES, PODCAST_SINCE_DATE
+from jobqueue import JobKind
+from track import download_stream, print_download_summary
+from utils import sanitize_data, create_download_directory, MusicFormat, DownloadStatus, \
+    complete_partial_download
 from zspotify import ZSpotify
 
 EPISODE_INFO_URL = 'https://api.spotify.com/v1/episodes'
 SHOWS_URL = 'https://api.spotify.com/v1/shows'
+EPISODES_BATCH_SIZE = 50
 
 
 def get_episode_info(episode_id_str) -> Tuple[Optional[str], Optional[str]]:
@@ -21,54 +27,103 @@ def get_episode_info(episode_id_str) -> Tuple[Optional[str], Optional[str]]:
     return sanitize_data(info[SHOW][NAME]), sanitize_data(info[NAME])
 
 
-def get_show_episodes(show_id_str) -> list:
-    """Returns the list of episodes for the given show name"""
-    episodes = []
-    offset = 0
-    limit = 50
-
-    while True:
-        resp = ZSpotify.invoke_url_with_params(f'{SHOWS_URL}/{show_id_str}/episodes',
-                                               limit=limit, offset=offset)
-        offset += limit
-        for episode in resp[ITEMS]:
-            episodes.append(episode[ID])
-        if len(resp[ITEMS]) < limit:
-            break
-
-    return episodes
-
-
-def download_episode(episode_id) -> None:
+def get_episodes_info(episode_ids) -> Dict[str, Tuple[str, str]]:
+    """Returns (podcast name, episode name) of many episodes, leaving out unknown ones"""
+    episodes_info = {}
+    episode_ids = list(dict.fromkeys(episode_ids))
+    for start in range(0, len(episode_ids), EPISODES_BATCH_SIZE):
+        batch = episode_ids[start:start + EPISODES_BATCH_SIZE]
+        info = ZSpotify.invoke_url(f'{EPISODE_INFO_URL}?ids={",".join(batch)}&market=from_token')
+        for episode_id, episode in zip(batch, info.get(EPISODES, [])):
+            if episode:
+                episodes_info[episode_id] = (sanitize_data(episode[SHOW][NAME]),
+                                             sanitize_data(episode[NAME]))
+    return episodes_info
+
+
+def is_released_before(release_date, since) -> bool:
+    """Returns whether an episode was released before the since date"""
+    # A release date of year or month precision ("2020", "2020-05") is only compared up to that
+    # precision, so an episode that may have come out on or after since is kept
+    return release_date < since[:len(release_date)]
+
+
+def iter_show_episodes(show_id_str, newest=0, since='') -> Iterator[str]:
+    """Yields the ids of the episodes of a show, newest first"""
+    # Listing stops after newest episodes when it is set, and at the first episode released
+    # before the since date
+    episodes = ZSpotify.iter_url_paginated(f'{SHOWS_URL}/{show_id_str}/episodes', limit=50)
+    for count, episode in enumerate(episodes):
+        if newest and count >= newest:
+            return
+        if since and is_released_before(episode[RELEASE_DATE], since):
+            return
+        yield episode[ID]
+
+
+def get_episode_path(podcast_name, episode_name) -> str:
+    """Returns where an episode is saved"""
+    return os.path.join(os.path.dirname(__file__), ZSpotify.get_config(ROOT_PODCAST_PATH),
+                        podcast_name, f'{podcast_name} - {episode_name}.{MusicFormat.OGG.value}')
+
+
+def download_show(show_id) -> None:
+    """Downloads the episodes of a show on a pool of MAX_CONCURRENT_DOWNLOADS workers"""
+    # Only the newest PODCAST_NEWEST_EPISODES and the ones released since PODCAST_SINCE_DATE are
+    # listed when those are set, and episodes already on disk are skipped
+    episode_ids = list(iter_show_episodes(show_id, ZSpotify.get_config(PODCAST_NEWEST_EPISODES),
+                                          ZSpotify.get_config(PODCAST_SINCE_DATE)))
+    episodes_info = get_episodes_info(episode_ids)
+    if ZSpotify.get_job_sink() is not None:
+        for episode_id in episode_ids:
+            download_episode(episode_id, episodes_info.get(episode_id))
+        return
+    workers = max(1, int(ZSpotify.get_config(MAX_CONCURRENT_DOWNLOADS)))
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            tqdm(total=len(episode_ids), desc='Episodes', unit='episode') as p_bar:
+        futures = [executor.submit(download_episode, episode_id, episodes_info.get(episode_id),
+                                   disable_progressbar=workers > 1)
+                   for episode_id in episode_ids]
+        for future in futures:
+            future.add_done_callback(lambda _: p_bar.update(1))
+    print_download_summary([(episode_id, future.result())
+                            for episode_id, future in zip(episode_ids, futures)])
+
+
+def download_episode(episode_id, episode_info=None, disable_progressbar=False) -> DownloadStatus:
     """Downloads the podcast with the specified id"""
-    podcast_name, episode_name = get_episode_info(episode_id)
+    # episode_info is prefetched metadata. While a batch url is expanded on this thread the
+    # episode is only queued on its job sink.
+    if ZSpotify.get_job_sink() is not None:
+        ZSpotify.get_job_sink().add_job(JobKind.EPISODE, episode_id, info=episode_info)
+        return DownloadStatus.QUEUED
 
-    extra_paths = podcast_name + '/'
+    podcast_name, episode_name = episode_info or get_episode_info(episode_id)
 
     if podcast_name is None:
         print('###   SKIPPING: (EPISODE NOT FOUND)   ###')
-    else:
-        filename = podcast_name + ' - ' + episode_name
-
-        episode_id = EpisodeId.from_base62(episode_id)
-        stream = ZSpotify.get_content_stream(episode_id, ZSpotify.DOWNLOAD_QUALITY)
-
-        download_directory = (os.path.dirname(__file__) +
-                              ZSpotify.get_config(ROOT_PODCAST_PATH) + extra_paths)
-        create_download_directory(download_directory)
-
-        total_size = stream.input_stream.size
-        with open(download_directory + filename + MusicFormat.OGG.value,
-                  'wb') as file, tqdm(
-            desc=filename,
-            total=total_size,
-            unit='B',
-            unit_scale=True,
-            unit_divisor=1024
-        ) as p_bar:
-            for _ in range(int(total_size / ZSpotify.get_config(CHUNK_SIZE)) + 1):
-                p_bar.update(file.write(
-                    stream.input_stream.stream().read(ZSpotify.get_config(CHUNK_SIZE))))
-
-        # convert_audio_format(ROOT_PODCAST_PATH +
-        #                     extra_paths + filename + '.ogg')
+        return DownloadStatus.UNAVAILABLE
+
+    filename = f'{podcast_name} - {episode_name}'
+    episode_path = get_episode_path(podcast_name, episode_name)
+    if os.path.isfile(episode_path) and os.path.getsize(episode_path) \
+            and ZSpotify.get_config(SKIP_EXISTING_FILES):
+        print('\n###   SKIPPING:', filename, '(EPISODE ALREADY EXISTS)   ###')
+        return DownloadStatus.SKIPPED
+
+    try:
+        with ZSpotify.lease_session():
+            stream = ZSpotify.get_content_stream(EpisodeId.from_base62(episode_id),
+                                                 ZSpotify.get_download_quality())
+            create_download_directory(os.path.dirname(episode_path))
+
+            # Long episodes resume from their .part file instead of starting over
+            quality = ZSpotify.get_download_quality().name \
+                if ZSpotify.get_download_quality() else None
+            download_stream(stream, episode_path, episode_id, quality, filename,
+                            disable_progressbar)
+            complete_partial_download(episode_path)
+    except Exception:  # pylint: disable=W0703
+        print('###   SKIPPING:', filename, '(GENERAL DOWNLOAD ERROR)   ###')
+        return DownloadStatus.FAILED
+    return DownloadStatus.DOWNLOADED
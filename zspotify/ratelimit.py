@@ -0,0 +1,77 @@
+"""This module provides an adaptive token bucket used to pace Web API calls and stream opens"""
+import threading
+import time
+from typing import Optional
+
+BACKOFF_BASE = 1.0
+
+BACKOFF_MAX = 60.0
+
+RECOVERY_FACTOR = 1.1
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """Returns the Retry-After header value in seconds, or None if it is missing or not a number"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:  # pylint: disable=R0902
+    """Token bucket that halves its rate when throttled and recovers it on healthy responses"""
+
+    def __init__(self, rate: float, burst: float = 1):
+        self.max_rate = rate
+        self.min_rate = rate / 16
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.stats = {'calls': 0, 'throttled_calls': 0, 'total_wait': 0.0, 'max_wait': 0.0}
+
+    def acquire(self) -> float:
+        """Blocks until a call may be made and returns the seconds spent waiting"""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                delay = self.blocked_until - now
+                if delay <= 0 and self.tokens >= 1:
+                    self.tokens -= 1
+                    self.record_wait(waited)
+                    return waited
+                if delay <= 0:
+                    delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def record_wait(self, waited: float) -> None:
+        """Adds one call and the time it waited to the stats, the lock must be held"""
+        self.stats['calls'] += 1
+        if waited > 0:
+            self.stats['throttled_calls'] += 1
+            self.stats['total_wait'] += waited
+            self.stats['max_wait'] = max(self.stats['max_wait'], waited)
+
+    def throttled(self, retry_after: Optional[float] = None) -> float:
+        """Halves the rate and holds every caller back"""
+        # Waits retry_after seconds, or an exponential backoff when the server did not say how long
+        with self.lock:
+            self.failures += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+            if retry_after is None:
+                retry_after = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self.failures - 1))
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            return retry_after
+
+    def succeeded(self) -> None:
+        """Steps the rate back up towards the configured maximum"""
+        with self.lock:
+            self.failures = 0
+            self.rate = min(self.max_rate, self.rate * RECOVERY_FACTOR)
@@ -0,0 +1,90 @@
+"""This module provides the pool of logged in accounts that downloads are spread across"""
+import threading
+import time
+from typing import Any, List
+
+from librespot.audio import CdnManager
+from librespot.mercury import MercuryClient
+
+from ratelimit import RateLimiter
+
+FAILOVER_COOLDOWN = 30.0
+
+# Errors of a throttled or disconnected account, another account may open the same stream
+ACCOUNT_ERRORS = (OSError, RuntimeError, CdnManager.CdnException, MercuryClient.MercuryException)
+
+# librespot raises RuntimeError with these for content no account can stream
+CONTENT_ERROR_MESSAGES = ('Content is restricted!', 'Content is unrecognized!',
+                          'Content has no audio file!', 'No content passed!',
+                          'Cannot get alternative track')
+
+
+def is_account_error(error: Exception) -> bool:
+    """Returns whether opening a stream failed because of the account rather than the content"""
+    # A restricted or unavailable track fails the same way on every account
+    return isinstance(error, ACCOUNT_ERRORS) and str(error) not in CONTENT_ERROR_MESSAGES
+
+
+class PooledSession:  # pylint: disable=R0902, R0903
+    """A logged in account with its own token cache, download quality and stream pacing"""
+
+    # pylint: disable=R0913
+    def __init__(self, name, session, token_cache, quality, stream_limiter: RateLimiter = None):
+        self.name = name
+        self.session = session
+        self.token_cache = token_cache
+        self.quality: Any = quality
+        self.stream_limiter = stream_limiter
+        self.leases = 0
+        self.available_at = 0.0
+        self.failures = 0
+
+
+class SessionPool:
+    """Leases the least busy account that is not cooling down after a failure"""
+
+    def __init__(self, sessions: List[PooledSession]):
+        self.sessions = sessions
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def acquire(self) -> PooledSession:
+        """Leases a session, waiting while every account is cooling down"""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                ready = [pooled for pooled in self.sessions if pooled.available_at <= now]
+                if ready:
+                    pooled = min(ready, key=lambda candidate: candidate.leases)
+                    pooled.leases += 1
+                    return pooled
+                self.condition.wait(min(pooled.available_at for pooled in self.sessions) - now)
+
+    def release(self, pooled: PooledSession) -> None:
+        """Returns a leased session"""
+        with self.condition:
+            pooled.leases -= 1
+            self.condition.notify_all()
+
+    def failed(self, pooled: PooledSession, cooldown=None) -> None:
+        """Keeps an account that was throttled or disconnected out of new leases for a while"""
+        # For cooldown seconds when given, otherwise FAILOVER_COOLDOWN doubled on every failure
+        # in a row
+        with self.condition:
+            pooled.failures += 1
+            if cooldown is None:
+                cooldown = FAILOVER_COOLDOWN * 2 ** (pooled.failures - 1)
+            pooled.available_at = time.monotonic() + cooldown
+
+    def succeeded(self, pooled: PooledSession) -> None:
+        """Clears the failures of an account"""
+        with self.condition:
+            pooled.failures = 0
+
+    def failover(self, pooled: PooledSession, cooldown=None) -> PooledSession:
+        """Gives a failed lease back and leases another account in its place"""
+        self.failed(pooled, cooldown)
+        self.release(pooled)
+        return self.acquire()
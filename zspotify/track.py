@@ -1,91 +1,422 @@
 """This module provides function related to individual tracks and downloading the tracks"""
 import os
 import time
-from typing import Any, Tuple, List
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Tuple, List, Dict, Iterator
 
 from librespot.audio.decoders import AudioQuality
 from librespot.metadata import TrackId
-from pydub import AudioSegment
 from tqdm import tqdm
 
-from const import TRACKS, ALBUM, NAME, ITEMS, DISC_NUMBER, TRACK_NUMBER, IS_PLAYABLE, ARTISTS, \
+from const import TRACKS, TRACK, ALBUM, NAME, DISC_NUMBER, TRACK_NUMBER, IS_PLAYABLE, ARTISTS, \
     RELEASE_DATE, ID, TRACKS_URL, SAVED_TRACKS_URL, SPLIT_ALBUM_DISCS, ROOT_PATH, DOWNLOAD_FORMAT, \
-    SKIP_EXISTING_FILES, ANTI_BAN_WAIT_TIME, OVERRIDE_AUTO_WAIT, IMAGES, CHUNK_SIZE, URL
-from utils import sanitize_data, set_audio_tags, set_music_thumbnail, create_download_directory, \
-    MusicFormat
+    SKIP_EXISTING_FILES, IMAGES, CHUNK_SIZE, URL, \
+    MAX_CONCURRENT_DOWNLOADS, TRANSCODE_QUEUE_SIZE, STREAMING_TRANSCODE, \
+    CONTENT_STORE_PATH, DUPLICATE_POLICY, EXTERNAL_IDS, ISRC, ALBUM_TYPE
+from transcode import TranscodePipeline, transcode_and_tag, tag_file, \
+    open_stream_encoder, close_stream_encoder
+from jobqueue import JobKind
+from library import TRACK_COMMENT_PREFIX
+from utils import sanitize_data, create_download_directory, get_artwork, DownloadStatus, chunked, \
+    DuplicatePolicy, link_file, get_partial_path, get_encoding_path, resume_partial_download, \
+    save_partial_state, complete_partial_download, discard_partial_download, claim_path, \
+    release_path
 from zspotify import ZSpotify
 
+TRACKS_BATCH_SIZE = 50
 
-def get_saved_tracks() -> list:
-    """ Returns user's saved tracks """
-    songs = []
-    offset = 0
-    limit = 50
+MIN_CHUNK_SIZE = 16 * 1024
 
-    while True:
-        resp = ZSpotify.invoke_url_with_params(
-            SAVED_TRACKS_URL, limit=limit, offset=offset)
-        offset += limit
-        songs.extend(resp[ITEMS])
-        if len(resp[ITEMS]) < limit:
-            break
+MAX_CHUNK_SIZE = 1024 * 1024
 
-    return songs
+CHUNK_TARGET_SECONDS = 0.25
 
 
-def get_song_info(song_id) -> Tuple[List[str], str, str, Any, Any, Any, Any, Any, Any]:
+def iter_saved_track_ids() -> Iterator[str]:
+    """ Yields the ids of user's saved tracks as each page arrives """
+    for song in ZSpotify.iter_url_paginated(SAVED_TRACKS_URL, limit=50):
+        if not song[TRACK][NAME]:
+            print('###   SKIPPING:  SONG DOES NOT EXIST ON SPOTIFY ANYMORE   ###')
+        else:
+            yield song[TRACK][ID]
+
+
+def get_song_info(song_id) -> Tuple[List[str], str, str, Any, Any, Any, Any, Any, Any, Tuple]:
     """ Retrieves metadata for downloaded songs """
     info = ZSpotify.invoke_url(f'{TRACKS_URL}?ids={song_id}&market=from_token')
+    return parse_song_info(info[TRACKS][0])
+
 
+# pylint: disable=W0703
+# noinspection PyBroadException
+def get_songs_info(song_ids) -> Dict[str, Tuple]:
+    """ Retrieves metadata for many songs, TRACKS_BATCH_SIZE ids per request """
+    songs_info = {}
+    for batch in chunked(dict.fromkeys(song_ids), TRACKS_BATCH_SIZE):
+        try:
+            info = ZSpotify.invoke_url(get_songs_url(batch))
+        except Exception:
+            # The songs of a failed batch are left out, download_track looks them up one by one
+            continue
+        songs_info.update(parse_songs_response(batch, info))
+    return songs_info
+
+
+def get_songs_url(song_ids) -> str:
+    """ Returns the url of the batch tracks request for song_ids """
+    return f'{TRACKS_URL}?ids={",".join(song_ids)}&market=from_token'
+
+
+# pylint: disable=W0703
+# noinspection PyBroadException
+def parse_songs_response(song_ids, info) -> Dict[str, Tuple]:
+    """ Returns the song info of every track found by the batch request for song_ids """
+    songs_info = {}
+    # The response keeps the order of the requested ids, unknown ids come back as null
+    for song_id, track in zip(song_ids, info.get(TRACKS) or []):
+        try:
+            if track:
+                songs_info[song_id] = parse_song_info(track)
+        except Exception:
+            # Left out so download_track looks it up again and reports it when that fails too
+            continue
+    return songs_info
+
+
+def parse_song_info(track, album=None) -> Tuple[List[str], str, str, Any, Any, Any, Any, Any,
+                                                Any, Tuple]:
+    """ Extracts the metadata needed for downloading from a track object """
+    # The simplified tracks embedded in an album object take their album details from album,
+    # they carry no ISRC so the recording of their info is (None, album type, release date)
+    album = album or track[ALBUM]
     artists = []
-    for data in info[TRACKS][0][ARTISTS]:
+    for data in track[ARTISTS]:
         artists.append(sanitize_data(data[NAME]))
-    album_name = sanitize_data(info[TRACKS][0][ALBUM][NAME])
-    name = sanitize_data(info[TRACKS][0][NAME])
-    image_url = info[TRACKS][0][ALBUM][IMAGES][0][URL]
-    release_year = info[TRACKS][0][ALBUM][RELEASE_DATE].split('-')[0]
-    disc_number = info[TRACKS][0][DISC_NUMBER]
-    track_number = info[TRACKS][0][TRACK_NUMBER]
-    scraped_song_id = info[TRACKS][0][ID]
-    is_playable = info[TRACKS][0][IS_PLAYABLE]
+    album_name = sanitize_data(album[NAME])
+    name = sanitize_data(track[NAME])
+    image_url = album[IMAGES][0][URL]
+    release_year = album[RELEASE_DATE].split('-')[0]
+    disc_number = track[DISC_NUMBER]
+    track_number = track[TRACK_NUMBER]
+    scraped_song_id = track[ID]
+    is_playable = track[IS_PLAYABLE]
+    recording = (track.get(EXTERNAL_IDS, {}).get(ISRC), album.get(ALBUM_TYPE),
+                 album[RELEASE_DATE])
 
     return (artists, album_name, name, image_url, release_year, disc_number, track_number,
-            scraped_song_id, is_playable)
+            scraped_song_id, is_playable, recording)
 
 
-# pylint: disable=R0914, W0703
-# noinspection PyBroadException
-def download_track(track_id: str, extra_paths='', prefix=False,
-                   prefix_value='', disable_progressbar=False) -> None:
+# pylint: disable=R0913
+def download_track(track_id: str, extra_paths='', prefix=False, prefix_value='',
+                   disable_progressbar=False, track_info=None, transcoder=None,
+                   duplicate_of=None) -> DownloadStatus:
     """ Downloads raw song audio from Spotify """
+    # track_info is prefetched metadata, transcoder queues the conversion instead of running it
+    # inline and duplicate_of is the library path of the same recording, linked instead
+
+    if ZSpotify.get_job_sink() is not None:
+        ZSpotify.get_job_sink().add_job(JobKind.TRACK, track_id, extra_paths,
+                                        prefix_value if prefix else '', track_info)
+        return DownloadStatus.QUEUED
+
+    if track_id in find_indexed_tracks([track_id]):
+        print('\n###   SKIPPING:', track_id, '(SONG ALREADY IN LIBRARY)   ###')
+        status = DownloadStatus.SKIPPED
+    else:
+        with ZSpotify.lease_session():
+            status = download_leased_track(track_id, extra_paths, prefix, prefix_value,
+                                           disable_progressbar, track_info, transcoder,
+                                           duplicate_of)
+    ZSpotify.METRICS.increment('tracks', status=status.value)
+    return status
+
 
+# pylint: disable=R0911, R0913, R0914, W0703
+# noinspection PyBroadException
+def download_leased_track(track_id, extra_paths, prefix, prefix_value, disable_progressbar,
+                          track_info, transcoder, duplicate_of) -> DownloadStatus:
+    """ The part of download_track that talks to Spotify """
+    # Runs on the account leased from the session pool when there is one
     try:
-        track_info = get_song_info(track_id)
-        (artists, _, name, _, _, disc_number, _, scraped_song_id, is_playable) = track_info
+        if track_info is None:
+            with ZSpotify.METRICS.timed('metadata'):
+                track_info = get_song_info(track_id)
+        (artists, _, name, _, _, disc_number, _, scraped_song_id, is_playable, _) = track_info
         song_name, filename, download_directory = \
             pre_process_metadata(extra_paths, disc_number, artists, name, prefix, prefix_value)
     except Exception:
         print('###   SKIPPING SONG - FAILED TO QUERY METADATA   ###')
-    else:
-        try:
-            if not is_playable:
-                print('\n###   SKIPPING:', song_name,
-                      '(SONG IS UNAVAILABLE)   ###')
-            else:
-                if os.path.isfile(filename) and os.path.getsize(filename) \
-                        and ZSpotify.get_config(SKIP_EXISTING_FILES):
-                    print('\n###   SKIPPING:', song_name,
-                          '(SONG ALREADY EXISTS)   ###')
-                else:
-                    stream = get_track_stream(track_id, scraped_song_id)
-                    create_download_directory(download_directory)
-                    write_stream_to_file(stream, filename, song_name,
-                                         disable_progressbar, track_info)
-        except Exception:
-            print('###   SKIPPING:', song_name,
-                  '(GENERAL DOWNLOAD ERROR)   ###')
-            if os.path.exists(filename):
-                os.remove(filename)
+        return DownloadStatus.METADATA_ERROR
+
+    store_path = None
+    try:
+        if not is_playable:
+            print('\n###   SKIPPING:', song_name,
+                  '(SONG IS UNAVAILABLE)   ###')
+            return DownloadStatus.UNAVAILABLE
+        if os.path.isfile(filename) and os.path.getsize(filename) \
+                and ZSpotify.get_config(SKIP_EXISTING_FILES):
+            print('\n###   SKIPPING:', song_name,
+                  '(SONG ALREADY EXISTS)   ###')
+            record_download(track_id, filename, quality=None)
+            return DownloadStatus.SKIPPED
+        create_download_directory(download_directory)
+        if duplicate_of:
+            print('\n###   LINKING:', song_name, '(RECORDING ALREADY IN LIBRARY)   ###')
+            finish_download(track_id, duplicate_of, None, filename)
+            return DownloadStatus.LINKED
+        store_path = claim_store_path(scraped_song_id)
+        if store_path is not None and os.path.isfile(store_path) \
+                and os.path.getsize(store_path):
+            print('\n###   LINKING:', song_name, '(SONG ALREADY IN STORE)   ###')
+            finish_download(track_id, store_path, get_quality_name(), filename)
+            release_path(store_path)
+            return DownloadStatus.LINKED
+        stream = get_track_stream(track_id, scraped_song_id)
+        queued = write_stream_to_file(
+            stream, store_path or filename, song_name, disable_progressbar, track_info,
+            transcoder, track_id, link_to=filename if store_path else None,
+            on_done=(lambda: release_path(store_path)) if store_path else None)
+        # A conversion queued on transcoder releases the store entry once it is done
+        if store_path is not None and not queued:
+            release_path(store_path)
+        return DownloadStatus.DOWNLOADED
+    except Exception:
+        print('###   SKIPPING:', song_name,
+              '(GENERAL DOWNLOAD ERROR)   ###')
+        # The .part file is kept so the next attempt resumes where this one stopped
+        for path in (filename, store_path):
+            if path and os.path.exists(get_encoding_path(path)):
+                os.remove(get_encoding_path(path))
+        if store_path is not None:
+            release_path(store_path)
+        return DownloadStatus.FAILED
+
+
+class CollectionDownload:  # pylint: disable=R0902
+    """ The bookkeeping of downloading a collection """
+    # Shared by the thread pool of download_tracks and the asyncio engine. Its methods block,
+    # the engine runs them on worker threads.
+
+    # pylint: disable=R0913
+    def __init__(self, extra_paths='', prefix=False, desc=None, songs_info=None, total=None,
+                 skip=(), duplicates=None):
+        self.extra_paths = extra_paths
+        self.prefix = prefix
+        self.songs_info = songs_info
+        self.skip = skip
+        self.duplicates = duplicates
+        self.find_duplicates = duplicates is None and songs_info is None
+        self.chosen = {}
+        self.indexed = {}
+        self.planned = set()
+        self.results = []
+        self.transcoder = TranscodePipeline(ZSpotify.get_config(TRANSCODE_QUEUE_SIZE))
+        self.p_bar = tqdm(total=total, desc=desc, unit='song', unit_scale=True)
+
+    def get_missing_ids(self, batch) -> List[str]:
+        """ Returns the ids of batch whose metadata still has to be fetched """
+        # Tracks the library index already has or that are skipped are left out
+        self.indexed = find_indexed_tracks(batch)
+        self.indexed.update((track_id, None) for track_id in batch if track_id in self.skip)
+        if self.songs_info is not None:
+            return []
+        return [track_id for track_id in batch if track_id not in self.indexed]
+
+    def plan_batch(self, batch, batch_info) -> List[Tuple[int, dict]]:
+        """ Numbers the tracks of batch and returns the ones to download """
+        # Each comes as its position and download_track arguments, the others are counted as skipped
+        # The others are counted as skipped
+        if self.songs_info is not None:
+            batch_info = self.songs_info
+        if self.duplicates is None:
+            self.duplicates = {} if self.find_duplicates else \
+                find_duplicate_recordings(self.songs_info, self.chosen)
+        if self.find_duplicates:
+            self.duplicates.update(find_duplicate_recordings(batch_info, self.chosen))
+        downloads = []
+        for track_id in batch:
+            self.results.append((track_id, DownloadStatus.SKIPPED))
+            if track_id in self.indexed:
+                self.p_bar.update(1)
+                continue
+            if track_id in self.planned:
+                # A second download of the same id would write the same files at the same time
+                print('\n###   SKIPPING:', track_id, '(REPEATED IN COLLECTION)   ###')
+                self.p_bar.update(1)
+                continue
+            self.planned.add(track_id)
+            if track_id in self.duplicates and self.duplicates[track_id] is None:
+                print('\n###   SKIPPING:', track_id, '(DUPLICATE RECORDING)   ###')
+                self.p_bar.update(1)
+                continue
+            downloads.append((len(self.results) - 1, {
+                'track_id': track_id, 'extra_paths': self.extra_paths, 'prefix': self.prefix,
+                'prefix_value': str(len(self.results)), 'disable_progressbar': True,
+                'track_info': batch_info.get(track_id), 'transcoder': self.transcoder,
+                'duplicate_of': self.duplicates.get(track_id)}))
+        return downloads
+
+    def finished(self, position, status: DownloadStatus) -> None:
+        """ Records the outcome of the download planned at position """
+        self.results[position] = (self.results[position][0], status)
+        self.p_bar.update(1)
+
+    def close(self) -> None:
+        """ Waits for the queued transcodes """
+        self.transcoder.close()
+        self.p_bar.close()
+
+    def get_results(self) -> List[Tuple[str, DownloadStatus]]:
+        """ Prints and returns the outcome of every track once closed """
+        # A track whose transcode failed counts as failed
+        results = [(track_id, DownloadStatus.FAILED if track_id in self.transcoder.errors
+                    else status) for track_id, status in self.results]
+        print_download_summary(results)
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# pylint: disable=R0913
+def download_tracks(track_ids, extra_paths='', prefix=False, desc=None, songs_info=None,
+                    total=None, skip=(), duplicates=None) -> List[Tuple[str, DownloadStatus]]:
+    """ Downloads tracks on a pool of MAX_CONCURRENT_DOWNLOADS workers """
+    workers = max(1, int(ZSpotify.get_config(MAX_CONCURRENT_DOWNLOADS)))
+    pending = {}
+
+    def collect(futures):
+        for future in futures:
+            collection.finished(pending.pop(future), future.result())
+
+    with CollectionDownload(extra_paths, prefix, desc, songs_info, total, skip,
+                            duplicates) as collection, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        # track_ids may be a generator still paging through the collection, only a few
+        # downloads are queued ahead of the workers so memory stays bounded
+        for batch in chunked(track_ids, TRACKS_BATCH_SIZE):
+            batch_info = get_songs_info(collection.get_missing_ids(batch))
+            for position, arguments in collection.plan_batch(batch, batch_info):
+                pending[executor.submit(download_track, **arguments)] = position
+                while len(pending) >= workers * 2:
+                    collect(wait(pending, return_when=FIRST_COMPLETED).done)
+        collect(wait(pending).done)
+
+    return collection.get_results()
+
+
+def find_indexed_tracks(track_ids) -> Dict[str, str]:
+    """ Returns the library path of every track among track_ids to skip """
+    # With a content store nothing is skipped here, every collection folder still needs its link
+    index = ZSpotify.get_library_index()
+    if index is None or not ZSpotify.get_config(SKIP_EXISTING_FILES) \
+            or ZSpotify.get_config(CONTENT_STORE_PATH):
+        return {}
+    return index.existing(track_ids, ZSpotify.get_config(DOWNLOAD_FORMAT))
+
+
+def get_recording_rank(recording, policy):
+    """ Returns the sort key that puts the preferred release of a recording first """
+    _, album_type, release_date = recording
+    album_rank = ('album', 'single', 'compilation').index(album_type) \
+        if album_type in ('album', 'single', 'compilation') else 3
+    if policy == DuplicatePolicy.PREFER_EARLIEST:
+        return release_date or '9999', album_rank
+    return album_rank, release_date or '9999'
+
+
+def find_duplicate_recordings(songs_info, chosen) -> Dict[str, Any]:
+    """ Returns the tracks of songs_info that repeat a recording kept elsewhere """
+    # Each maps to the library path of the copy to link, or to None when that copy is part of
+    # this run. DUPLICATE_POLICY picks the release that is kept, chosen maps the ISRC of every
+    # kept recording to its track id and is carried over between calls.
+    policy = DuplicatePolicy(ZSpotify.get_config(DUPLICATE_POLICY))
+    if policy == DuplicatePolicy.KEEP_ALL:
+        return {}
+    candidates = {}
+    for track_id, info in songs_info.items():
+        recording, is_playable = info[9], info[8]
+        if recording[0] and is_playable:
+            candidates.setdefault(recording[0], []).append(
+                (get_recording_rank(recording, policy), track_id))
+
+    in_library = {}
+    index = ZSpotify.get_library_index()
+    if index is not None:
+        index.record_recordings({track_id: isrc for isrc, tracks in candidates.items()
+                                 for _, track_id in tracks})
+        in_library = index.find_recordings(candidates, ZSpotify.get_config(DOWNLOAD_FORMAT))
+
+    duplicates = {}
+    for isrc, tracks in candidates.items():
+        kept, path = in_library.get(isrc, (chosen.get(isrc), None))
+        if kept is None:
+            kept = chosen[isrc] = min(tracks)[1]
+        for _, track_id in tracks:
+            if track_id != kept:
+                duplicates[track_id] = path
+    return duplicates
+
+
+def get_quality_name():
+    """ Returns the name of the download quality """
+    quality = ZSpotify.get_download_quality()
+    return quality.name if quality else None
+
+
+def get_store_path(track_id):
+    """ Returns where the content store keeps track_id at the current quality and format """
+    if not track_id or not ZSpotify.get_config(CONTENT_STORE_PATH):
+        return None
+    return os.path.join(os.path.dirname(__file__), ZSpotify.get_config(CONTENT_STORE_PATH),
+                        track_id[:2], f'{track_id}-{str(get_quality_name()).lower()}.'
+                                      f'{ZSpotify.get_config(DOWNLOAD_FORMAT)}')
+
+
+def claim_store_path(track_id):
+    """ Returns the content store path of track_id claimed for this download """
+    # None when there is no content store or another download is writing that entry
+    store_path = get_store_path(track_id)
+    if store_path is None:
+        return None
+    create_download_directory(os.path.dirname(store_path))
+    if not claim_path(store_path):
+        # Sharing the other download's .part file would corrupt both, this one downloads
+        # a copy of its own instead
+        return None
+    return store_path
+
+
+def finish_download(track_id, filename, quality, link_to=None) -> None:
+    """ Adds the download to the library index, linking it to link_to first """
+    if link_to:
+        link_file(filename, link_to)
+        filename = link_to
+    record_download(track_id, filename, quality)
+
+
+def record_download(track_id, filename, quality=None) -> None:
+    """ Adds a finished download to the library index """
+    index = ZSpotify.get_library_index()
+    if index is not None:
+        index.record(track_id, filename, ZSpotify.get_config(DOWNLOAD_FORMAT), quality)
+
+
+def print_download_summary(results) -> None:
+    """ Prints how many tracks ended in each state and which ones failed """
+    counts = Counter(status for _, status in results)
+    print('\n###   ' + ', '.join(f'{status.value}: {count}'
+                                 for status, count in counts.items()) + '   ###')
+    failed = [track_id for track_id, status in results
+              if status in (DownloadStatus.FAILED, DownloadStatus.METADATA_ERROR)]
+    if failed:
+        print('###   FAILED TRACKS: ' + ', '.join(failed) + '   ###')
 
 
 # pylint: disable=R0913
@@ -114,43 +445,142 @@ def get_track_stream(track_id, scraped_song_id):
         track_id = scraped_song_id
     track_id = TrackId.from_base62(track_id)
     return ZSpotify.get_content_stream(
-        track_id, ZSpotify.DOWNLOAD_QUALITY)
+        track_id, ZSpotify.get_download_quality())
+
+
+# pylint: disable=R0913
+def write_stream_to_file(stream, filename, song_name, disable_progressbar, track_info,
+                         transcoder=None, track_id=None, link_to=None, on_done=None) -> bool:
+    """Writes the audio stream to file and records it in the library index"""
+    # With link_to, file is a content store entry that is linked there. Returns True when the
+    # conversion was queued on transcoder, which then calls on_done.
+    artists, album_name, name, image_url, release_year, disc_number, track_number, \
+        scraped_song_id, _, _ = track_info
+    track_id = track_id or scraped_song_id
+    quality = get_quality_name()
+    download_format = ZSpotify.get_config(DOWNLOAD_FORMAT)
+    streaming = download_format == 'mp3' and ZSpotify.get_config(STREAMING_TRANSCODE)
+    if streaming:
+        # An encoder cannot pick up half way through, so streamed songs always start over
+        encoder = open_stream_encoder(get_encoding_path(filename), download_format,
+                                      get_bitrate())
+        try:
+            with encoder.stdin as file, ZSpotify.METRICS.timed('stream_transcode'):
+                copy_stream(stream.input_stream.stream(), file, stream.input_stream.size,
+                            song_name, disable_progressbar)
+        finally:
+            close_stream_encoder(encoder)
+    else:
+        download_stream(stream, filename, scraped_song_id, quality, song_name,
+                        disable_progressbar)
 
+    if download_format == 'mp3':
+        # The artwork is fetched here so the transcode processes never touch the network
+        artwork = get_artwork(image_url)
+        tags = (artists, name, album_name, release_year, disc_number, track_number, artwork,
+                f'{TRACK_COMMENT_PREFIX}{track_id}')
+        if streaming:
+            with ZSpotify.METRICS.timed('tag'):
+                tag_file(get_encoding_path(filename), *tags)
+            complete_partial_download(filename, get_encoding_path(filename))
+        elif transcoder is None:
+            ZSpotify.METRICS.observe_all(
+                transcode_and_tag(filename, download_format, get_bitrate(), *tags))
+        else:
+            transcoder.submit(track_id, filename, download_format, get_bitrate(), *tags,
+                              on_success=lambda: finish_download(track_id, filename, quality,
+                                                                 link_to),
+                              on_done=on_done)
+            return True
+    else:
+        complete_partial_download(filename)
+    finish_download(track_id, filename, quality, link_to)
+    return False
 
-def write_stream_to_file(stream, filename, song_name, disable_progressbar, track_info):
-    """Writes the audio stream to file"""
+
+# pylint: disable=R0913
+def download_stream(stream, filename, content_id, quality, desc, disable_progressbar=False):
+    """Downloads the stream to the .part file of filename"""
+    # Continues from the bytes an earlier attempt at the same content and quality left there.
+    # The sidecar next to the .part file always records how far it got.
     total_size = stream.input_stream.size
-    artists, album_name, name, image_url, release_year, disc_number, track_number, _, _ = track_info
-    with open(filename, 'wb') as file, tqdm(
-            desc=song_name,
+    source = stream.input_stream.stream()
+    offset = resume_partial_download(filename, content_id, quality)
+    if offset > total_size:
+        discard_partial_download(filename)
+        offset = 0
+    if offset:
+        source.seek(offset)
+    save_partial_state(filename, content_id, quality, offset)
+    try:
+        with open(get_partial_path(filename), 'ab' if offset else 'wb') as file, \
+                ZSpotify.METRICS.timed('download'):
+            copy_stream(source, file, total_size, desc, disable_progressbar, offset)
+    finally:
+        # The file is closed and flushed here, so its size counts what an interrupted copy
+        # got through as well
+        save_partial_state(filename, content_id, quality,
+                           os.path.getsize(get_partial_path(filename)))
+
+
+def get_readinto(source):
+    """Returns source.readinto when it reads the same data as source.read"""
+    # librespot's AbsChunkedInputStream subclasses io.BytesIO but only overrides read, so the
+    # readinto it inherits reads the empty BytesIO buffer and reports EOF at once
+    mro = type(source).__mro__
+    read_owner = next((base for base in mro if 'read' in vars(base)), None)
+    readinto_owner = next((base for base in mro if 'readinto' in vars(base)), None)
+    if read_owner is None or readinto_owner is None or \
+            not issubclass(readinto_owner, read_owner):
+        return None
+    return source.readinto
+
+
+# pylint: disable=R0913, R0914
+def copy_stream(source, file, total_size, desc, disable_progressbar=False, offset=0) -> int:
+    """Copies the rest of source into file and returns the number of bytes copied"""
+    # Reads go into one preallocated buffer when get_readinto allows it. The chunk size starts at
+    # CHUNK_SIZE and doubles or halves to keep each read near CHUNK_TARGET_SECONDS.
+    chunk_size = min(max(ZSpotify.get_config(CHUNK_SIZE), MIN_CHUNK_SIZE), MAX_CHUNK_SIZE)
+    buffer = memoryview(bytearray(MAX_CHUNK_SIZE))
+    readinto = get_readinto(source)
+    remaining = total_size - offset
+    copied = 0
+    with tqdm(
+            desc=desc,
             total=total_size,
+            initial=offset,
             unit='B',
             unit_scale=True,
             unit_divisor=1024,
             disable=disable_progressbar
     ) as p_bar:
-        for _ in range(int(total_size / ZSpotify.get_config(CHUNK_SIZE)) + 1):
-            p_bar.update(file.write(
-                stream.input_stream.stream().read(ZSpotify.get_config(CHUNK_SIZE))))
-
-    if ZSpotify.get_config(DOWNLOAD_FORMAT) == 'mp3':
-        convert_audio_format(filename)
-        set_audio_tags(filename, artists, name, album_name,
-                       release_year, disc_number, track_number)
-        set_music_thumbnail(filename, image_url)
-
-    if not ZSpotify.get_config(OVERRIDE_AUTO_WAIT):
-        time.sleep(ZSpotify.get_config(ANTI_BAN_WAIT_TIME))
-
-
-def convert_audio_format(filename) -> None:
-    """ Converts raw audio into playable mp3 """
-    # print('###   CONVERTING TO ' + MUSIC_FORMAT.upper() + '   ###')
-    raw_audio = AudioSegment.from_file(filename, format=MusicFormat.OGG.value,
-                                       frame_rate=44100, channels=2, sample_width=2)
-    if ZSpotify.DOWNLOAD_QUALITY == AudioQuality.VERY_HIGH:
-        bitrate = '320k'
-    else:
-        bitrate = '160k'
-    raw_audio.export(filename, format=ZSpotify.get_config(
-        DOWNLOAD_FORMAT), bitrate=bitrate)
+        while copied < remaining:
+            size = min(chunk_size, remaining - copied)
+            started = time.perf_counter()
+            if readinto is not None:
+                read = readinto(buffer[:size]) or 0
+                data = buffer[:read]
+            else:
+                data = source.read(size)
+                read = len(data)
+            elapsed = time.perf_counter() - started
+            if read <= 0:
+                break
+            file.write(data)
+            p_bar.update(read)
+            copied += read
+
+            if elapsed < CHUNK_TARGET_SECONDS / 2 and read == chunk_size:
+                chunk_size = min(chunk_size * 2, MAX_CHUNK_SIZE)
+            elif elapsed > CHUNK_TARGET_SECONDS * 2:
+                chunk_size = max(chunk_size // 2, MIN_CHUNK_SIZE)
+    ZSpotify.METRICS.increment('downloaded_bytes', copied)
+    return copied
+
+
+def get_bitrate() -> str:
+    """ Returns the mp3 bitrate matching the download quality """
+    if ZSpotify.get_download_quality() == AudioQuality.VERY_HIGH:
+        return '320k'
+    return '160k'
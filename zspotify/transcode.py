@@ -0,0 +1,145 @@
+"""This module provides the transcoding stage that converts and tags downloaded tracks"""
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+from pydub import AudioSegment
+from pydub.utils import get_encoder_name
+
+from utils import MusicFormat, set_audio_tags, get_partial_path, get_encoding_path, \
+    complete_partial_download
+from zspotify import ZSpotify
+
+
+def transcode_file(source, target, download_format, bitrate) -> None:
+    """ Converts the raw ogg audio in source to download_format in target """
+    raw_audio = AudioSegment.from_file(source, format=MusicFormat.OGG.value,
+                                       frame_rate=44100, channels=2, sample_width=2)
+    raw_audio.export(target, format=download_format, bitrate=bitrate)
+
+
+def open_stream_encoder(filename, download_format, bitrate) -> subprocess.Popen:
+    """ Starts an encoder that reads raw ogg audio on stdin and writes filename """
+    # The audio is never held in memory or written to disk twice
+    return subprocess.Popen(
+        [get_encoder_name(), '-hide_banner', '-loglevel', 'error', '-y',
+         '-f', MusicFormat.OGG.value, '-i', 'pipe:0', '-vn',
+         '-b:a', bitrate, '-f', download_format, filename],
+        stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def close_stream_encoder(encoder: subprocess.Popen) -> None:
+    """ Waits for a stream encoder to flush its output, raising if it failed """
+    if not encoder.stdin.closed:
+        encoder.stdin.close()
+    error = encoder.stderr.read()
+    if encoder.wait() != 0:
+        raise RuntimeError(f'Encoder failed: {error.decode(errors="replace").strip()}')
+
+
+# pylint: disable=R0913
+def tag_file(filename, artists, name, album_name, release_year, disc_number, track_number,
+             artwork, comment=None) -> None:
+    """ Writes the tags and artwork of an already converted file """
+    set_audio_tags(filename, artists, name, album_name,
+                   release_year, disc_number, track_number, artwork, comment)
+
+
+# pylint: disable=R0913
+def transcode_and_tag(filename, download_format, bitrate, artists, name, album_name,
+                      release_year, disc_number, track_number, artwork, comment=None) -> dict:
+    """ Converts the finished .part download of filename and tags it """
+    # The file is only moved into place once tagged. The seconds each stage took are returned
+    # since this may run in a pool process that cannot record them itself.
+    encoding_path = get_encoding_path(filename)
+    started = time.perf_counter()
+    transcode_file(get_partial_path(filename), encoding_path, download_format, bitrate)
+    transcoded = time.perf_counter()
+    tag_file(encoding_path, artists, name, album_name, release_year, disc_number, track_number,
+             artwork, comment)
+    complete_partial_download(filename, encoding_path)
+    return {'transcode': transcoded - started, 'tag': time.perf_counter() - transcoded}
+
+
+class TranscodePipeline:
+    """Runs transcode_and_tag on the shared transcode process pool"""
+
+    def __init__(self, queue_size=0):
+        self.executor = ZSpotify.get_transcode_executor()
+        self.slots = threading.BoundedSemaphore(
+            queue_size or ZSpotify.get_transcode_workers() * 2)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.pending = 0
+        self.errors = {}
+
+    def submit(self, key, filename, *args, on_success=None, on_done=None) -> Future:
+        """Queues filename for transcoding, blocking while the queue is full"""
+        # A failed job removes the file and records its exception under key, a successful one
+        # calls on_success. on_done is called after either.
+        # The slot is released by finished once the job is done
+        self.slots.acquire()  # pylint: disable=R1732
+        with self.lock:
+            self.pending += 1
+        try:
+            future = self.submit_job(filename, *args)
+        except BaseException:
+            self.slots.release()
+            with self.lock:
+                self.pending -= 1
+            raise
+        future.add_done_callback(
+            lambda done: self.finished(key, filename, done, on_success, on_done))
+        return future
+
+    def submit_job(self, filename, *args) -> Future:
+        """Submits transcode_and_tag to the pool, replacing the pool once if it broke"""
+        try:
+            return self.executor.submit(transcode_and_tag, filename, *args)
+        except BrokenProcessPool:
+            # A pool process that crashed breaks the shared pool for every later collection
+            self.executor = ZSpotify.replace_transcode_executor(self.executor)
+            return self.executor.submit(transcode_and_tag, filename, *args)
+
+    # pylint: disable=R0913
+    def finished(self, key, filename, future, on_success=None, on_done=None) -> None:
+        """Frees the queue slot of a finished job and records its failure"""
+        self.slots.release()
+        try:
+            self.record(key, filename, future, on_success)
+        finally:
+            if on_done is not None:
+                on_done()
+            with self.lock:
+                self.pending -= 1
+                self.idle.notify_all()
+
+    def record(self, key, filename, future, on_success=None) -> None:
+        """Records the outcome of a finished job"""
+        if future.exception() is None:
+            ZSpotify.METRICS.observe_all(future.result())
+            if on_success is not None:
+                on_success()
+        else:
+            print('###   SKIPPING:', os.path.basename(filename), '(TRANSCODE ERROR)   ###')
+            ZSpotify.METRICS.increment('transcode_failures')
+            with self.lock:
+                self.errors[key] = future.exception()
+            # The complete .part file stays, so a retry only has to convert it again
+            if os.path.exists(get_encoding_path(filename)):
+                os.remove(get_encoding_path(filename))
+
+    def close(self) -> None:
+        """Waits for every job queued on this pipeline to finish"""
+        # The pool is shared, it stays up for the rest of the run
+        with self.lock:
+            self.idle.wait_for(lambda: not self.pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,16 +1,22 @@
 """THis modules provides common function used by multiple modules"""
+import json
 import os
 import platform
 import re
+import shutil
 import time
 from enum import Enum
-from typing import List, Tuple, Match
+from itertools import islice
+from typing import Iterator, List, Tuple, Match
 
 import music_tag
-import requests
 
 from const import SANITIZE, ARTIST, TRACKTITLE, ALBUM, YEAR, DISCNUMBER, TRACKNUMBER, ARTWORK, \
-    WINDOWS_SYSTEM, TRACK_ID, ALBUM_ID, PLAYLIST_ID, EPISODE_ID, SHOW_ID, ARTIST_ID
+    WINDOWS_SYSTEM, TRACK_ID, ALBUM_ID, PLAYLIST_ID, EPISODE_ID, SHOW_ID, ARTIST_ID, COMMENT
+from zspotify import ZSpotify
+
+# A claim this old was left behind by a run that crashed before releasing it
+CLAIM_STALE_SECONDS = 3600
 
 
 class MusicFormat(str, Enum):
@@ -19,11 +25,126 @@ class MusicFormat(str, Enum):
     OGG = 'ogg'
 
 
+class DuplicatePolicy(str, Enum):
+    """Which release of a recording found under several track ids is downloaded"""
+    KEEP_ALL = 'keep_all'
+    PREFER_ALBUM = 'prefer_album'
+    PREFER_EARLIEST = 'prefer_earliest'
+
+
+class DownloadStatus(str, Enum):
+    """Outcome of a single track download"""
+    DOWNLOADED = 'downloaded'
+    SKIPPED = 'skipped'
+    UNAVAILABLE = 'unavailable'
+    LINKED = 'linked'
+    QUEUED = 'queued'
+    METADATA_ERROR = 'metadata error'
+    FAILED = 'failed'
+
+
 def create_download_directory(download_path: str) -> None:
     """Creates directory with the provided path"""
     os.makedirs(download_path, exist_ok=True)
 
 
+def chunked(iterable, size) -> Iterator[list]:
+    """ Yields lists of up to size consecutive items, consuming iterable lazily """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def link_file(source, target) -> None:
+    """ Makes target point at the same content as source, replacing it """
+    # A hardlink where the filesystem allows it, otherwise a symlink, otherwise a copy
+    temp_target = f'{target}.link'
+    if os.path.lexists(temp_target):
+        os.remove(temp_target)
+    try:
+        os.link(source, temp_target)
+    except OSError:
+        try:
+            os.symlink(os.path.abspath(source), temp_target)
+        except OSError:
+            shutil.copyfile(source, temp_target)
+    os.replace(temp_target, target)
+
+
+def claim_path(path) -> bool:
+    """ Claims the right to write path for this download, False while another holds it """
+    # The .claim file is shared by threads and processes
+    claim = f'{path}.claim'
+    for _ in range(2):
+        try:
+            os.close(os.open(claim, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(claim) < CLAIM_STALE_SECONDS:
+                    return False
+                os.remove(claim)
+            except OSError:
+                return False
+    return False
+
+
+def release_path(path) -> None:
+    """ Releases the claim on path taken with claim_path """
+    if os.path.exists(f'{path}.claim'):
+        os.remove(f'{path}.claim')
+
+
+def get_partial_path(filename) -> str:
+    """ Returns the path raw audio is downloaded to before it is complete """
+    return f'{filename}.part'
+
+
+def get_encoding_path(filename) -> str:
+    """ Returns the path a file is converted and tagged at before it is moved into place """
+    root, extension = os.path.splitext(filename)
+    return f'{root}.encoding{extension}'
+
+
+def resume_partial_download(filename, content_id, quality) -> int:
+    """ Returns how many bytes of content_id are already in the .part file of filename """
+    # A .part file left behind by another download or quality is discarded
+    partial_path = get_partial_path(filename)
+    try:
+        with open(f'{partial_path}.json', encoding='utf-8') as state_file:
+            state = json.load(state_file)
+        if state['content_id'] == content_id and state['quality'] == quality:
+            return os.path.getsize(partial_path)
+    except (OSError, ValueError, KeyError):
+        pass
+    discard_partial_download(filename)
+    return 0
+
+
+def save_partial_state(filename, content_id, quality, bytes_written) -> None:
+    """ Writes the sidecar describing the .part file of filename """
+    with open(f'{get_partial_path(filename)}.json', 'w', encoding='utf-8') as state_file:
+        json.dump({'content_id': content_id, 'quality': quality,
+                   'bytes_written': bytes_written}, state_file)
+
+
+def complete_partial_download(filename, source=None) -> None:
+    """ Atomically moves source, by default the finished .part file, to filename """
+    os.replace(source or get_partial_path(filename), filename)
+    discard_partial_download(filename)
+
+
+def discard_partial_download(filename) -> None:
+    """ Removes the .part file of filename and its sidecar """
+    partial_path = get_partial_path(filename)
+    for path in (partial_path, f'{partial_path}.json'):
+        if os.path.exists(path):
+            os.remove(path)
+
+
 def wait(seconds: int = 3) -> None:
     """ Pause for a set number of seconds """
     for second in range(seconds)[::-1]:
@@ -72,8 +193,8 @@ def sanitize_data(value) -> str:
 
 # pylint: disable=R0913
 def set_audio_tags(filename, artists, name, album_name, release_year,
-                   disc_number, track_number) -> None:
-    """ sets music_tag metadata """
+                   disc_number, track_number, artwork=None, comment=None) -> None:
+    """ sets music_tag metadata and cover artwork in a single load and save """
     tags = music_tag.load_file(filename)
     tags[ARTIST] = conv_artist_format(artists)
     tags[TRACKTITLE] = name
@@ -81,6 +202,10 @@ def set_audio_tags(filename, artists, name, album_name, release_year,
     tags[YEAR] = release_year
     tags[DISCNUMBER] = disc_number
     tags[TRACKNUMBER] = track_number
+    if artwork:
+        tags[ARTWORK] = artwork
+    if comment:
+        tags[COMMENT] = comment
     tags.save()
 
 
@@ -89,12 +214,10 @@ def conv_artist_format(artists) -> str:
     return ', '.join(artists)
 
 
-def set_music_thumbnail(filename, image_url) -> None:
-    """ Downloads cover artwork """
-    img = requests.get(image_url).content
-    tags = music_tag.load_file(filename)
-    tags[ARTWORK] = img
-    tags.save()
+def get_artwork(image_url) -> bytes:
+    """ Returns the cover artwork image, downloading each url once per run """
+    with ZSpotify.METRICS.timed('artwork'):
+        return ZSpotify.get_artwork_cache().get(image_url)
 
 
 def regex_input_for_urls(search_input) -> Tuple[str, str, str, str, str, str]:
@@ -6,38 +6,133 @@ It's like youtube-dl, but for Spotify.
 
 (Made by Deathmonger/Footsiefat - @doomslayer117:matrix.org)
 """
+import asyncio
 import json
+import multiprocessing
 import os
 import os.path
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from getpass import getpass
-from typing import Any
+from itertools import islice
+from typing import Any, AsyncIterator, Iterator
+from urllib.parse import urlsplit
 
 import requests
-from librespot.audio.decoders import VorbisOnlyAudioQuality
+from requests.adapters import HTTPAdapter
+from librespot.audio.decoders import AudioQuality, VorbisOnlyAudioQuality
 from librespot.core import Session
 
 from const import CREDENTIALS_JSON, TYPE, \
     PREMIUM, USER_READ_EMAIL, AUTHORIZATION, OFFSET, LIMIT, CONFIG_FILE_PATH, FORCE_PREMIUM, \
-    PLAYLIST_READ_PRIVATE, CONFIG_DEFAULT_SETTINGS
+    PLAYLIST_READ_PRIVATE, CONFIG_DEFAULT_SETTINGS, HTTP_POOL_SIZE, HTTP_TIMEOUT, ACCEPT_ENCODING, \
+    RETRY_AFTER, API_RATE_LIMIT, MAX_RETRIES, ANTI_BAN_WAIT_TIME, OVERRIDE_AUTO_WAIT, \
+    ARTWORK_CACHE_SIZE, ARTWORK_CACHE_PATH, ARTWORK_MAX_SIZE, LIBRARY_INDEX_PATH, ITEMS, TOTAL, \
+    PAGINATION_CONCURRENCY, IF_NONE_MATCH, ETAG, RESPONSE_CACHE_PATH, RESPONSE_CACHE_TTLS, \
+    RESPONSE_CACHE_MAX_MB, ASYNC_API_CONCURRENCY, CREDENTIAL_FILES, TRANSCODE_WORKERS, \
+    MARKET_FROM_TOKEN
+from artwork import ArtworkCache
+from cache import ResponseCache
+from jobqueue import JobQueue
+from library import LibraryIndex
+from metrics import Metrics, get_endpoint
+from ratelimit import RateLimiter, parse_retry_after
+from sessions import PooledSession, SessionPool, is_account_error
 
+TOKEN_EXPIRY_MARGIN = 60
 
-class ZSpotify:
+
+class TokenCache:
+    """Holds a Web API bearer token until shortly before it expires"""
+
+    def __init__(self, session: Session):
+        self.session = session
+        self.token = None
+        self.expires_at = 0.0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'refreshes': 0}
+
+    def get_token(self) -> str:
+        """Returns the cached token, fetching a new one once if it is missing or about to expire"""
+        with self.lock:
+            if self.token is not None and time.monotonic() < self.expires_at:
+                self.count('hits')
+                return self.token
+            if self.token is not None:
+                self.count('refreshes')
+                self.drop_token()
+            else:
+                self.count('misses')
+            stored_token = self.session.tokens().get_token(USER_READ_EMAIL, PLAYLIST_READ_PRIVATE)
+            self.token = stored_token.access_token
+            # librespot hands out the token it already holds until shortly before it expires,
+            # so its lifetime runs from when it was issued, in microseconds of wall clock time
+            remaining = stored_token.timestamp / 1e6 + stored_token.expires_in - time.time()
+            self.expires_at = time.monotonic() + max(remaining - TOKEN_EXPIRY_MARGIN, 0)
+            return self.token
+
+    def invalidate(self) -> None:
+        """Drops the cached token so the next call fetches a fresh one"""
+        with self.lock:
+            self.expires_at = 0.0
+
+    def drop_token(self) -> None:
+        """Removes the cached token from librespot's token provider"""
+        # librespot would otherwise hand the same token out again until its own expiry threshold
+        tokens = self.session.tokens()._TokenProvider__tokens  # pylint: disable=W0212
+        tokens[:] = [token for token in tokens if token.access_token != self.token]
+
+    def count(self, result) -> None:
+        """Counts a token lookup in stats and in the run metrics"""
+        self.stats[result] += 1
+        ZSpotify.METRICS.increment('token_cache', result=result)
+
+
+class ZSpotify:  # pylint: disable=R0904
     """This class initializes the spotify session with provides user credentials"""
     SESSION: Session = None
+    TOKEN_CACHE: TokenCache = None
     DOWNLOAD_QUALITY = None
     CONFIG = {}
+    HTTP_CLIENT: requests.Session = None
+    HTTP_CLIENT_LOCK = threading.Lock()
+    ARTWORK_CACHE: ArtworkCache = None
+    ARTWORK_CACHE_LOCK = threading.Lock()
+    LIBRARY_INDEX: LibraryIndex = None
+    LIBRARY_INDEX_LOCK = threading.Lock()
+    RESPONSE_CACHE: ResponseCache = None
+    RESPONSE_CACHE_LOCK = threading.Lock()
+    RESPONSE_CACHE_BYPASS = False
+    API_LIMITER: RateLimiter = None
+    STREAM_LIMITER: RateLimiter = None
+    API_SEMAPHORE: asyncio.Semaphore = None
+    API_SEMAPHORE_LOOP = None
+    TRANSCODE_EXECUTOR: ProcessPoolExecutor = None
+    TRANSCODE_EXECUTOR_LOCK = threading.Lock()
+    JOB_SINKS = threading.local()
+    SESSION_POOL: SessionPool = None
+    LEASES = threading.local()
+    METRICS = Metrics()
 
     def __init__(self):
         ZSpotify.load_config()
+        ZSpotify.setup_rate_limiters()
         ZSpotify.login()
 
     @classmethod
     def login(cls):
         """ Authenticates with Spotify and saves credentials to a file """
 
+        if cls.get_config(CREDENTIAL_FILES):
+            cls.login_pool()
+            return
         if os.path.isfile(CREDENTIALS_JSON):
             try:
                 cls.SESSION = Session.Builder().stored_file().create()
+                cls.TOKEN_CACHE = TokenCache(cls.SESSION)
                 return
             except RuntimeError:
                 pass
@@ -48,10 +143,69 @@ class ZSpotify:
             password = getpass()
             try:
                 cls.SESSION = Session.Builder().user_pass(user_name, password).create()
+                cls.TOKEN_CACHE = TokenCache(cls.SESSION)
                 return
             except RuntimeError:
                 pass
 
+    @classmethod
+    def login_pool(cls):
+        """ Logs in every account of CREDENTIAL_FILES into the session pool """
+        # The first one that works also serves the calls made outside a lease
+        pooled = []
+        for credentials in cls.get_config(CREDENTIAL_FILES):
+            try:
+                session = Session.Builder().stored_file(credentials).create()
+            except RuntimeError:
+                print(f'###   SKIPPING ACCOUNT: {credentials} (LOGIN FAILED)   ###')
+                continue
+            # librespot keeps the tokens of every session in one list on the TokenProvider
+            # class, give each account a list of its own so it never gets another one's token
+            session.tokens()._TokenProvider__tokens = []  # pylint: disable=W0212
+            quality = AudioQuality.VERY_HIGH if cls.is_premium(session) else AudioQuality.HIGH
+            pooled.append(PooledSession(credentials, session, TokenCache(session), quality,
+                                        cls.make_stream_limiter()))
+        if not pooled:
+            raise RuntimeError('None of the CREDENTIAL_FILES could log in.')
+        print(f'###   LOGGED IN {len(pooled)} ACCOUNTS   ###')
+        cls.SESSION_POOL = SessionPool(pooled)
+        cls.SESSION = pooled[0].session
+        cls.TOKEN_CACHE = pooled[0].token_cache
+
+    @classmethod
+    @contextmanager
+    def lease_session(cls):
+        """ Leases a pooled account to the current thread for the block """
+        # Streams and Web API calls made inside it use that account. Without a pool, or inside
+        # another lease, nothing changes.
+        if cls.SESSION_POOL is None or cls.get_leased_session() is not None:
+            yield cls.get_leased_session()
+            return
+        cls.LEASES.session = cls.SESSION_POOL.acquire()
+        try:
+            yield cls.LEASES.session
+        finally:
+            cls.SESSION_POOL.release(cls.LEASES.session)
+            cls.LEASES.session = None
+
+    @classmethod
+    def get_leased_session(cls) -> PooledSession:
+        """ Returns the account leased to the current thread, or None """
+        return getattr(cls.LEASES, 'session', None)
+
+    @classmethod
+    def get_download_quality(cls):
+        """ Returns the download quality of the account leased to the current thread """
+        # Outside a lease that is DOWNLOAD_QUALITY
+        leased = cls.get_leased_session()
+        return leased.quality if leased is not None else cls.DOWNLOAD_QUALITY
+
+    @classmethod
+    def get_token_cache(cls) -> TokenCache:
+        """ Returns the token cache of the account leased to the current thread """
+        leased = cls.get_leased_session()
+        return leased.token_cache if leased is not None else cls.TOKEN_CACHE
+
     @classmethod
     def load_config(cls) -> None:
         """Loads the zspotify config json file to dictionary"""
@@ -65,21 +219,72 @@ class ZSpotify:
             with open(true_config_file_path, encoding='utf-8') as config_file:
                 cls.CONFIG = json.load(config_file)
 
+    @classmethod
+    def setup_rate_limiters(cls) -> None:
+        """Creates the limiters pacing Web API calls and stream opens from the config"""
+        api_rate = cls.get_config(API_RATE_LIMIT)
+        cls.API_LIMITER = RateLimiter(api_rate, burst=api_rate)
+        cls.STREAM_LIMITER = cls.make_stream_limiter()
+
+    @classmethod
+    def make_stream_limiter(cls) -> RateLimiter:
+        """Returns a limiter pacing the stream opens of one account"""
+        # None is returned when the wait between songs is disabled
+        if cls.get_config(OVERRIDE_AUTO_WAIT) or not cls.get_config(ANTI_BAN_WAIT_TIME):
+            return None
+        return RateLimiter(1 / cls.get_config(ANTI_BAN_WAIT_TIME))
+
     @classmethod
     def get_config(cls, key) -> Any:
-        """Return the value from the config for given key"""
-        return cls.CONFIG.get(key)
+        """Return the value from the config for given key, falling back to the default"""
+        return cls.CONFIG.get(key, CONFIG_DEFAULT_SETTINGS.get(key))
 
     @classmethod
     def get_content_stream(cls, content_id, quality):
         """Returns stream for the provided track/episode id"""
-        return cls.SESSION.content_feeder().load(content_id, VorbisOnlyAudioQuality(quality),
-                                                 False, None)
+        # Inside a lease the stream comes from the leased account at its own quality, and an account
+        # that is throttled or disconnected is swapped for another one of the pool until every
+        # account was tried. Content that cannot be streamed fails at once.
+        leased = cls.get_leased_session()
+        if leased is None:
+            return cls.open_stream(cls.SESSION, cls.STREAM_LIMITER, content_id, quality)
+        for attempt in range(len(cls.SESSION_POOL)):
+            try:
+                stream = cls.open_stream(leased.session, leased.stream_limiter, content_id,
+                                         leased.quality)
+            except Exception as error:  # pylint: disable=W0703
+                if not is_account_error(error) or attempt == len(cls.SESSION_POOL) - 1:
+                    raise
+                print(f'###   ACCOUNT {leased.name} FAILED - SWITCHING ACCOUNTS   ###')
+                leased = cls.LEASES.session = cls.SESSION_POOL.failover(leased)
+                continue
+            cls.SESSION_POOL.succeeded(leased)
+            return stream
+        return None
+
+    @staticmethod
+    def open_stream(session, limiter, content_id, quality):
+        """Opens a stream on session, paced by limiter"""
+        if limiter is None:
+            with ZSpotify.METRICS.timed('stream_open'):
+                return session.content_feeder().load(content_id, VorbisOnlyAudioQuality(quality),
+                                                     False, None)
+        ZSpotify.METRICS.observe('anti_ban_wait', limiter.acquire())
+        try:
+            with ZSpotify.METRICS.timed('stream_open'):
+                stream = session.content_feeder().load(content_id,
+                                                       VorbisOnlyAudioQuality(quality), False, None)
+        except Exception as error:
+            if is_account_error(error):
+                limiter.throttled()
+            raise
+        limiter.succeeded()
+        return stream
 
     @classmethod
     def __get_auth_token(cls):
         """Returns authentication token"""
-        return cls.SESSION.tokens().get_token(USER_READ_EMAIL, PLAYLIST_READ_PRIVATE).access_token
+        return cls.get_token_cache().get_token()
 
     @classmethod
     def get_auth_header(cls):
@@ -94,17 +299,277 @@ class ZSpotify:
     @classmethod
     def invoke_url_with_params(cls, url, limit, offset, **kwargs):
         """Makes an http call to the provided url with auth headers and provided params"""
-        headers, params = cls.get_auth_header_and_params(limit=limit, offset=offset)
+        params = {LIMIT: limit, OFFSET: offset}
         params.update(kwargs)
-        return requests.get(url, headers=headers, params=params).json()
+        return cls.invoke_api(url, params)
 
     @classmethod
     def invoke_url(cls, url):
         """Makes an http call to the provided url with auth headers"""
-        headers = cls.get_auth_header()
-        return requests.get(url, headers=headers).json()
+        return cls.invoke_api(url)
+
+    @classmethod
+    def invoke_url_paginated(cls, url, limit, **kwargs) -> list:
+        """Returns the items of every page of a paginated endpoint in order"""
+        return list(cls.iter_url_paginated(url, limit, **kwargs))
+
+    @classmethod
+    def iter_url_paginated(cls, url, limit, **kwargs) -> Iterator:
+        """Yields the items of a paginated endpoint in order as their pages arrive"""
+        # The first page gives the total, the following offsets are fetched PAGINATION_CONCURRENCY
+        # pages ahead of the consumer
+        def fetch(offset):
+            return cls.invoke_url_with_params(url, limit=limit, offset=offset, **kwargs)
+
+        resp = fetch(0)
+        total = resp.get(TOTAL)
+        yield from resp[ITEMS]
+        if total is None:
+            # Without a total keep paging until a short page arrives
+            offset = limit
+            while len(resp[ITEMS]) == limit:
+                resp = fetch(offset)
+                yield from resp[ITEMS]
+                offset += limit
+            return
+
+        concurrency = max(1, cls.get_config(PAGINATION_CONCURRENCY))
+        offsets = iter(range(limit, total, limit))
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            window = deque(executor.submit(fetch, offset)
+                           for offset in islice(offsets, concurrency))
+            while window:
+                page = window.popleft().result()
+                next_offset = next(offsets, None)
+                if next_offset is not None:
+                    window.append(executor.submit(fetch, next_offset))
+                yield from page[ITEMS]
+
+    @classmethod
+    def get_job_sink(cls) -> JobQueue:
+        """Returns the job queue the current thread is expanding a batch url into, or None"""
+        return getattr(cls.JOB_SINKS, 'queue', None)
+
+    @classmethod
+    def set_job_sink(cls, queue: JobQueue) -> None:
+        """Makes the downloads started on the current thread go to queue as jobs"""
+        # A queue of None makes them run again
+        cls.JOB_SINKS.queue = queue
+
+    @classmethod
+    def get_api_semaphore(cls) -> asyncio.Semaphore:
+        """Returns the semaphore bounding the Web API calls in flight on the running loop"""
+        loop = asyncio.get_running_loop()
+        semaphore = cls.API_SEMAPHORE
+        if semaphore is None or cls.API_SEMAPHORE_LOOP is not loop:
+            semaphore = asyncio.Semaphore(max(1, int(cls.get_config(ASYNC_API_CONCURRENCY))))
+            cls.API_SEMAPHORE_LOOP = loop
+            cls.API_SEMAPHORE = semaphore
+        return semaphore
+
+    @classmethod
+    async def invoke_api_async(cls, url, params=None):
+        """Awaitable invoke_api, run on a worker thread once the API semaphore lets it in"""
+        async with cls.get_api_semaphore():
+            return await asyncio.to_thread(cls.invoke_api, url, params)
+
+    @classmethod
+    async def invoke_url_async(cls, url):
+        """Awaitable invoke_url"""
+        return await cls.invoke_api_async(url)
+
+    @classmethod
+    async def invoke_url_with_params_async(cls, url, limit, offset, **kwargs):
+        """Awaitable invoke_url_with_params"""
+        params = {LIMIT: limit, OFFSET: offset}
+        params.update(kwargs)
+        return await cls.invoke_api_async(url, params)
+
+    @classmethod
+    async def iter_url_paginated_async(cls, url, limit, **kwargs) -> AsyncIterator:
+        """Async iter_url_paginated, keeping PAGINATION_CONCURRENCY page requests ahead"""
+        resp = await cls.invoke_url_with_params_async(url, limit, 0, **kwargs)
+        total = resp.get(TOTAL)
+        for item in resp[ITEMS]:
+            yield item
+        if total is None:
+            offset = limit
+            while len(resp[ITEMS]) == limit:
+                resp = await cls.invoke_url_with_params_async(url, limit, offset, **kwargs)
+                for item in resp[ITEMS]:
+                    yield item
+                offset += limit
+            return
+
+        concurrency = max(1, cls.get_config(PAGINATION_CONCURRENCY))
+        offsets = iter(range(limit, total, limit))
+        window = deque(asyncio.ensure_future(
+            cls.invoke_url_with_params_async(url, limit, offset, **kwargs))
+            for offset in islice(offsets, concurrency))
+        try:
+            while window:
+                page = await window.popleft()
+                next_offset = next(offsets, None)
+                if next_offset is not None:
+                    window.append(asyncio.ensure_future(
+                        cls.invoke_url_with_params_async(url, limit, next_offset, **kwargs)))
+                for item in page[ITEMS]:
+                    yield item
+        finally:
+            for task in window:
+                task.cancel()
+
+    @classmethod
+    def invoke_api(cls, url, params=None):  # pylint: disable=R0912
+        """Makes a rate limited Web API call with retries"""
+        # 429 and 5xx responses are retried with backoff, requests.HTTPError is raised once
+        # MAX_RETRIES of them are used up. Endpoints with a TTL in RESPONSE_CACHE_TTLS are answered
+        # from the response cache while fresh and revalidated with their ETag once stale.
+        endpoint = get_endpoint(urlsplit(url).path)
+        cache = cls.get_response_cache()
+        ttl = cache.get_ttl(url) if cache is not None else None
+        cached = None
+        if ttl is not None:
+            # market=from_token answers, such as is_playable, differ between accounts
+            account = cls.get_token_cache().session.username() \
+                if MARKET_FROM_TOKEN in f'{url} {params}' else None
+            key = cache.get_key(url, params, account)
+            cached = cache.get(key)
+            if cached is not None and cached[2]:
+                cls.METRICS.increment('api_calls', endpoint=endpoint, status='cache')
+                return json.loads(cached[0])
+
+        for attempt in range(cls.get_config(MAX_RETRIES) + 1):
+            if cls.API_LIMITER is not None:
+                cls.METRICS.observe('api_wait', cls.API_LIMITER.acquire())
+            headers = cls.get_auth_header()
+            if cached is not None and cached[1]:
+                headers[IF_NONE_MATCH] = cached[1]
+            with cls.METRICS.timed('api'):
+                resp = cls.http_get(url, headers=headers, params=params)
+            cls.METRICS.increment('api_calls', endpoint=endpoint, status=resp.status_code)
+            if resp.status_code == 401 and attempt == 0:
+                cls.get_token_cache().invalidate()
+            elif resp.status_code == 429 or resp.status_code >= 500:
+                if cls.API_LIMITER is not None:
+                    cls.API_LIMITER.throttled(parse_retry_after(resp.headers.get(RETRY_AFTER)))
+            else:
+                if cls.API_LIMITER is not None:
+                    cls.API_LIMITER.succeeded()
+                break
+        else:
+            # Out of retries, the body is an error and not what the caller asked for
+            resp.raise_for_status()
+
+        if ttl is not None:
+            if resp.status_code == 304 and cached is not None:
+                cache.refresh(key, ttl)
+                return json.loads(cached[0])
+            if resp.status_code == 200:
+                cache.put(key, url, resp.text, resp.headers.get(ETAG), ttl)
+        return resp.json()
+
+    @classmethod
+    def get_response_cache(cls) -> ResponseCache:
+        """Returns the Web API response cache, or None when it is disabled or bypassed"""
+        if cls.RESPONSE_CACHE_BYPASS or not cls.get_config(RESPONSE_CACHE_PATH):
+            return None
+        if cls.RESPONSE_CACHE is None:
+            with cls.RESPONSE_CACHE_LOCK:
+                if cls.RESPONSE_CACHE is None:
+                    cls.RESPONSE_CACHE = ResponseCache(
+                        os.path.join(os.path.dirname(__file__),
+                                     cls.get_config(RESPONSE_CACHE_PATH)),
+                        cls.get_config(RESPONSE_CACHE_TTLS),
+                        cls.get_config(RESPONSE_CACHE_MAX_MB) * 1024 * 1024)
+        return cls.RESPONSE_CACHE
+
+    @classmethod
+    def get_transcode_workers(cls) -> int:
+        """Returns the number of transcode processes, one per CPU core unless set"""
+        return int(cls.get_config(TRANSCODE_WORKERS)) or os.cpu_count() or 1
+
+    @classmethod
+    def get_transcode_executor(cls) -> ProcessPoolExecutor:
+        """Returns the process pool every transcode pipeline shares"""
+        with cls.TRANSCODE_EXECUTOR_LOCK:
+            if cls.TRANSCODE_EXECUTOR is None:
+                # spawn keeps the children away from locks held by the download threads
+                cls.TRANSCODE_EXECUTOR = ProcessPoolExecutor(
+                    max_workers=cls.get_transcode_workers(),
+                    mp_context=multiprocessing.get_context('spawn'))
+            return cls.TRANSCODE_EXECUTOR
+
+    @classmethod
+    def replace_transcode_executor(cls, broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        """Drops a transcode process pool that broke and returns the one replacing it"""
+        with cls.TRANSCODE_EXECUTOR_LOCK:
+            if cls.TRANSCODE_EXECUTOR is broken:
+                cls.TRANSCODE_EXECUTOR = None
+        broken.shutdown(wait=False)
+        return cls.get_transcode_executor()
+
+    @classmethod
+    def get_http_client(cls) -> requests.Session:
+        """Returns the shared keep-alive http client, creating it on first use"""
+        if cls.HTTP_CLIENT is None:
+            with cls.HTTP_CLIENT_LOCK:
+                if cls.HTTP_CLIENT is None:
+                    pool_size = cls.get_config(HTTP_POOL_SIZE)
+                    # pool_block makes extra threads wait for a free connection
+                    # instead of opening throwaway ones
+                    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                          pool_block=True)
+                    client = requests.Session()
+                    client.mount('https://', adapter)
+                    client.mount('http://', adapter)
+                    client.headers[ACCEPT_ENCODING] = 'gzip, deflate'
+                    cls.HTTP_CLIENT = client
+        return cls.HTTP_CLIENT
+
+    @classmethod
+    def http_get(cls, url, **kwargs) -> requests.Response:
+        """Makes a GET request through the shared http client"""
+        kwargs.setdefault('timeout', cls.get_config(HTTP_TIMEOUT))
+        return cls.get_http_client().get(url, **kwargs)
+
+    @classmethod
+    def fetch_artwork(cls, image_url) -> bytes:
+        """Downloads cover artwork, raising on an error response so it is never cached"""
+        resp = cls.http_get(image_url)
+        resp.raise_for_status()
+        return resp.content
+
+    @classmethod
+    def get_artwork_cache(cls) -> ArtworkCache:
+        """Returns the shared artwork cache, creating it on first use"""
+        if cls.ARTWORK_CACHE is None:
+            with cls.ARTWORK_CACHE_LOCK:
+                if cls.ARTWORK_CACHE is None:
+                    directory = cls.get_config(ARTWORK_CACHE_PATH)
+                    if directory:
+                        directory = os.path.join(os.path.dirname(__file__), directory)
+                    cls.ARTWORK_CACHE = ArtworkCache(cls.fetch_artwork,
+                                                     cls.get_config(ARTWORK_CACHE_SIZE),
+                                                     directory, cls.get_config(ARTWORK_MAX_SIZE))
+        return cls.ARTWORK_CACHE
+
+    @classmethod
+    def get_library_index(cls) -> LibraryIndex:
+        """Returns the library index of downloaded tracks, or None when it is disabled"""
+        if cls.LIBRARY_INDEX is None and cls.get_config(LIBRARY_INDEX_PATH):
+            with cls.LIBRARY_INDEX_LOCK:
+                if cls.LIBRARY_INDEX is None:
+                    cls.LIBRARY_INDEX = LibraryIndex(os.path.join(
+                        os.path.dirname(__file__), cls.get_config(LIBRARY_INDEX_PATH)))
+        return cls.LIBRARY_INDEX
 
     @classmethod
     def check_premium(cls) -> bool:
         """ If user has spotify premium return true """
-        return (cls.SESSION.get_user_attribute(TYPE) == PREMIUM) or cls.get_config(FORCE_PREMIUM)
+        return cls.is_premium(cls.SESSION)
+
+    @classmethod
+    def is_premium(cls, session) -> bool:
+        """ If the account of session has spotify premium return true """
+        return (session.get_user_attribute(TYPE) == PREMIUM) or cls.get_config(FORCE_PREMIUM)